@@ -1,15 +1,27 @@
 import argparse
+import asyncio
+import importlib
 import os
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-import faiss
-import pandas as pd
 
-from providers.chatgpt import ChatGPTProvider
-from providers.deepseek import DeepSeekProvider
-from providers.mock import MockProvider
-from rag.retrieve import retrieve
-from rag.prompts import build_user_prompt, get_system_prompt
+
+# Respuestas aceptadas en los menús y comandos del modo interactivo
+_CHATGPT_KEYS = frozenset({"1", "chatgpt", "gpt", "openai"})
+_DEEPSEEK_KEYS = frozenset({"2", "deepseek", "ds"})
+_MOCK_KEYS = frozenset({"3", "mock", "m"})
+_COMPARE_KEYS = frozenset({"4", "compare", "cmp"})
+_YES_KEYS = frozenset({"sí", "si"})
+_EXIT_KEYS = frozenset({"exit", "salir", "quit"})
+_PROV_COMMANDS = frozenset({"/prov", "/provider", "/cambiar"})
+_COMPARE_COMMANDS = frozenset({"/compare", "compare", "4"})
+
+# Separadores de la salida de /compare
+_SEP80 = "=" * 80
+_SEP40 = "-" * 40
 
 
 def _prompt_provider_choice() -> str:
@@ -21,32 +33,280 @@ def _prompt_provider_choice() -> str:
     print("  [4] Compare (ChatGPT vs DeepSeek)")
     while True:
         choice = input("Elige proveedor: ").strip().lower()
-        if choice in ("1", "chatgpt", "gpt", "openai"):
+        if choice in _CHATGPT_KEYS:
             return "chatgpt"
-        if choice in ("2", "deepseek", "ds"):
+        if choice in _DEEPSEEK_KEYS:
             return "deepseek"
-        if choice in ("3", "mock", "m"):
+        if choice in _MOCK_KEYS:
             return "mock"
-        if choice in ("4", "compare", "cmp"):
+        if choice in _COMPARE_KEYS:
             return "compare"
         print("Opción no válida. Responde 1, 2 o 3.")
 
 
+# Instancias reutilizadas durante la sesión (evita recrear clientes HTTP y handshakes TLS)
+_PROVIDER_CACHE: dict = {}
+_PROVIDER_LOCK = threading.Lock()
+
+# Proveedores que se pueden forzar con /<clave>: etiqueta y sugerencia si no hay API key
+_FORCED_PROVIDERS = {
+    'deepseek': ("DeepSeek", "configura DEEPSEEK_API_KEY en tu .env o usa /chatgpt"),
+    'chatgpt': ("ChatGPT", "configura OPENROUTER_API_KEY u OPENAI_API_KEY en tu .env o usa /deepseek"),
+}
+
+
+def _get_provider(provider_key: str):
+    """Retorna la instancia cacheada del proveedor o la crea (propaga errores de inicialización)."""
+    if provider_key in _PROVIDER_CACHE:
+        return _PROVIDER_CACHE[provider_key]
+    # Importación diferida: solo se carga el SDK del proveedor elegido
+    if provider_key == 'chatgpt':
+        from providers.chatgpt import ChatGPTProvider
+        prov = ChatGPTProvider()
+    elif provider_key == 'deepseek':
+        from providers.deepseek import DeepSeekProvider
+        prov = DeepSeekProvider()
+    else:
+        from providers.mock import MockProvider
+        prov = MockProvider()
+    # Si el precalentamiento y el hilo principal la crearon a la vez, gana la primera
+    with _PROVIDER_LOCK:
+        return _PROVIDER_CACHE.setdefault(provider_key, prov)
+
+
+def _preload_modules(names) -> None:
+    """Importa módulos pesados en hilos de fondo; el primer import real espera al que ya está en curso."""
+    def _try(name: str) -> None:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass
+    pool = ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="preload")
+    for name in names:
+        pool.submit(_try, name)
+    pool.shutdown(wait=False)
+
+
+def _prewarm_providers() -> None:
+    """Crea en segundo plano y en paralelo las instancias de todos los proveedores.
+
+    Los errores se ignoran aquí: _instantiate_provider los reporta cuando el usuario elige el proveedor.
+    """
+    def _try(key: str) -> None:
+        try:
+            _get_provider(key)
+        except Exception:
+            pass
+    pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="prewarm")
+    for key in ('chatgpt', 'deepseek', 'mock'):
+        pool.submit(_try, key)
+    pool.shutdown(wait=False)
+
+
 def _instantiate_provider(provider_key: str):
-    """Crea una instancia del proveedor solicitado con manejo de errores."""
+    """Como _get_provider, pero degrada a Mock si el proveedor no se puede inicializar."""
     try:
-        if provider_key == 'chatgpt':
-            return ChatGPTProvider()
-        if provider_key == 'deepseek':
-            return DeepSeekProvider()
-        return MockProvider()
+        return _get_provider(provider_key)
     except Exception as e:
+        # No se cachea el fallback para volver a intentar en la próxima selección
+        from providers.mock import MockProvider
         print(f"No se pudo inicializar el proveedor '{provider_key}': {e}")
         print("Usando Mock para continuar sin costo…")
         return MockProvider()
 
 
+async def _timed_achat(label: str, prov, messages):
+    """Llama a un proveedor de forma asíncrona midiendo su latencia individual."""
+    start = time.perf_counter()
+    try:
+        ans = await prov.achat(messages)
+    except Exception as e:
+        ans = f"[Error proveedor] {e}"
+    elapsed = time.perf_counter() - start
+    return {
+        'label': label,
+        'model': prov.name,
+        'time': elapsed,
+        'answer': ans,
+    }
+
+
+def _compare_providers(messages) -> list:
+    """Consulta DeepSeek y ChatGPT en paralelo (latencia total = la del más lento)."""
+    # Instanciar antes de lanzar las llamadas: la construcción no bloquea el event loop ni se mide
+    providers = [(key.upper(), _instantiate_provider(key)) for key in ('deepseek', 'chatgpt')]
+
+    async def _run():
+        return await asyncio.gather(*(_timed_achat(label, prov, messages) for label, prov in providers))
+    return list(asyncio.run(_run()))
+
+
+# Índice y chunks cargados en main(); los usa _retrieve
+_INDEX = None
+_CHUNKS_DF = None
+# None: según RERANK_ENABLE; --no-rerank lo fuerza a False
+_RERANK = None
+
+
+def _retrieve(query: str, k: int) -> list:
+    """Dicts de contexto de la consulta; las repetidas las resuelve la caché del Retriever (RETRIEVAL_CACHE_*)."""
+    from rag.retrieve import retrieve
+    return retrieve(query, _INDEX, _CHUNKS_DF, k, as_dict=True, rerank=_RERANK)
+
+
+def _list_files(directory: str) -> set:
+    """Nombres de archivos de un directorio (vacío si no existe)."""
+    try:
+        with os.scandir(directory) as entries:
+            return {e.name for e in entries if e.is_file()}
+    except FileNotFoundError:
+        return set()
+
+
+def _warmup_retrieval() -> None:
+    """Ejecuta una búsqueda descartable para cargar el modelo de embeddings antes de la primera consulta."""
+    from rag.retrieve import retrieve
+    try:
+        retrieve('warmup', _INDEX, _CHUNKS_DF, 1, rerank=_RERANK)
+    except Exception:
+        pass
+
+
+def _print_comparison(question: str, comparisons: list, t_retr: float) -> None:
+    """Imprime la comparación de proveedores armando la salida completa y escribiéndola de una vez."""
+    fastest = min(comparisons, key=lambda x: x['time'])
+    slowest = max(comparisons, key=lambda x: x['time'])
+
+    lines = ["", _SEP80, "🔍 COMPARACIÓN DE RESPUESTAS", f"Pregunta: {question}", _SEP80, ""]
+    for comp in comparisons:
+        lines += [
+            f"🤖 {comp['label']}",
+            f"Modelo: {comp['model']}",
+            f"Tiempo: {comp['time']:.2f}s",
+            _SEP40,
+            comp['answer'],
+            _SEP40,
+            "",
+        ]
+    lines += [
+        "📊 ESTADÍSTICAS:",
+        f"Más rápido: {fastest['time']:.2f}s ({fastest['model']})",
+        f"Más lento: {slowest['time']:.2f}s ({slowest['model']})",
+        f"(Retrieve común): {t_retr:.2f}s",
+        "",
+    ]
+    sys.stdout.write("\n".join(lines) + "\n")
+    sys.stdout.flush()
+
+
+def _do_compare(comp_q: str, k: int, system_prompt: str) -> None:
+    """Recupera el contexto una sola vez, consulta DeepSeek y ChatGPT en paralelo e imprime la comparación."""
+    from rag.prompts import build_user_prompt
+
+    try:
+        t_retr0 = time.perf_counter()
+        context_docs = _retrieve(comp_q, k)
+        t_retr = time.perf_counter() - t_retr0
+    except FileNotFoundError:
+        context_docs = []
+        t_retr = 0.0
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": build_user_prompt(comp_q, context_docs)},
+    ]
+    _print_comparison(comp_q, _compare_providers(messages), t_retr)
+
+
+def _run_single(provider, query: str, k: int, system_prompt: str,
+                label: str = "Respuesta", semantic_cache=None) -> dict:
+    """Recupera contexto, consulta al proveedor (imprimiendo en streaming) y retorna las stats del turno."""
+    from providers.tokens import count_tokens, count_message_tokens
+    from rag.embedding_system import query_cache_info
+    from rag.prompts import build_user_prompt
+
+    t_start = time.perf_counter()
+    try:
+        t_retr0 = time.perf_counter()
+        chunks = _retrieve(query, k)
+        t_retr = time.perf_counter() - t_retr0
+    except FileNotFoundError as e:
+        print(f"[RAG deshabilitado] {e}")
+        chunks, t_retr = [], 0.0
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": build_user_prompt(query, chunks)},
+    ]
+
+    # Llamada al proveedor (o caché semántica) y medición de latencia
+    cached = None
+    if semantic_cache is not None:
+        q_vec = semantic_cache.embed(query)
+        cached = semantic_cache.lookup(q_vec, provider.name)
+    t_chat0 = time.perf_counter()
+    t_first = None
+    if cached is not None:
+        response = cached
+        t_chat = time.perf_counter() - t_chat0
+        print("[Caché semántica] Respuesta reutilizada de una consulta similar")
+        print(f"\n{label}:\n{response}\n")
+    else:
+        # Se imprime cada fragmento al llegar (latencia percibida = primer token)
+        print(f"\n{label}:")
+        parts = []
+        try:
+            for tok in provider.stream_chat(messages):
+                if t_first is None:
+                    t_first = time.perf_counter() - t_chat0
+                print(tok, end='', flush=True)
+                parts.append(tok)
+            response = ''.join(parts)
+            t_chat = time.perf_counter() - t_chat0
+            # Solo respuestas reales del modelo (no el texto de relleno sin API key ni vacías)
+            if semantic_cache is not None and provider.is_available and response.strip():
+                semantic_cache.add(q_vec, query, response, provider.name)
+        except Exception as e:
+            response = f"[Error proveedor] {e}"
+            t_chat = 0.0
+            print(response, end='')
+        print("\n")
+
+    tokens_in = count_message_tokens(messages)
+    tokens_out = count_tokens(response)
+    try:
+        cost = 0.0 if cached is not None else provider.estimate_cost(tokens_in, tokens_out)
+    except Exception:
+        cost = 0.0
+
+    return {
+        'provider': provider.name,
+        'answer': response,
+        'chunks': len(chunks),
+        'retr_time': t_retr,
+        'chat_time': t_chat,
+        'first_token_time': t_first,
+        'total_time': time.perf_counter() - t_start,
+        'tokens_in': tokens_in,
+        'tokens_out': tokens_out,
+        'cost': cost,
+        'embed_cache': query_cache_info(),
+    }
+
+
+def _print_stats(stats: dict, k: int) -> None:
+    print("[Stats]")
+    print(f"  Proveedor: {stats['provider']}")
+    print(f"  k: {k} | Chunks recuperados: {stats['chunks']}")
+    print(f"  Latencia retrieve: {stats['retr_time']:.3f}s | Latencia chat: {stats['chat_time']:.3f}s | Total: {stats['total_time']:.3f}s")
+    if stats['first_token_time'] is not None:
+        print(f"  Primer fragmento: {stats['first_token_time']:.3f}s")
+    print(f"  Tokens aprox IN: {stats['tokens_in']} | OUT: {stats['tokens_out']} | Costo estimado: ${stats['cost']:.6f}")
+    print(f"  Caché embeddings: {stats['embed_cache'].hits} hits | {stats['embed_cache'].misses} misses")
+
+
 def main():
+    global _INDEX, _CHUNKS_DF, _RERANK
     load_dotenv()
 
     parser = argparse.ArgumentParser()
@@ -54,18 +314,52 @@ def main():
     parser.add_argument('--k', type=int, default=5)
     parser.add_argument('--batch', action='store_true')
     parser.add_argument('--gold', default='eval/gold_set.jsonl')
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help='Llamadas simultáneas al proveedor en --batch (por defecto EVAL_PARALLELISM u 8)')
+    parser.add_argument('--no-cache', action='store_true', help='Desactiva la caché semántica de respuestas (SEMANTIC_CACHE_ENABLE)')
+    parser.add_argument('--no-rerank', action='store_true', help='Desactiva el rerank con cross-encoder')
     args = parser.parse_args()
+    if args.no_rerank:
+        _RERANK = False
+
+    # Importar en paralelo módulos independientes (faiss/pandas/pyarrow, sentence-transformers, evaluador)
+    modules = ['rag.retrieve', 'rag.prompts', 'rag.semantic_cache']
+    if args.batch:
+        modules.append('eval.quality_evaluator')
+    _preload_modules(modules)
+
+    # Construir clientes de proveedores (SDKs, TLS) mientras se cargan índice y chunks
+    _prewarm_providers()
+
+    # Importaciones pesadas diferidas (faiss, pandas, pyarrow, sentence-transformers)
+    from rag.retrieve import load_faiss_index, load_chunks_df, preferred_index_path
+    from rag.prompts import get_system_prompt
+    from rag.semantic_cache import SemanticCache, data_fingerprint
 
     # Cargar índice y chunks si existen (modo amistoso)
-    index = faiss.read_index('data/index.faiss') if os.path.exists('data/index.faiss') else None
-    chunks_df = None
-    chunks_df_path = 'data/processed/chunks_with_embeddings.parquet'
-    if os.path.exists(chunks_df_path):
-        chunks_df = pd.read_parquet(chunks_df_path)
-    else:
-        fallback = 'data/processed/chunks.parquet'
-        if os.path.exists(fallback):
-            chunks_df = pd.read_parquet(fallback)
+    # Un listado por directorio en lugar de un stat por archivo candidato
+    data_files = _list_files('data')
+    processed_files = _list_files('data/processed')
+
+    # Preferir el índice cuantizado (python -m rag.quantize_index) solo si no es más viejo que
+    # index.faiss: tras re-ejecutar rag.embed, un .sq8 antiguo apuntaría a filas de otros chunks
+    index, index_path = None, None
+    if data_files & {'index.faiss.sq8', 'index.faiss'}:
+        index_path = preferred_index_path(os.path.join('data', 'index.faiss'))
+        index = load_faiss_index(index_path)
+    chunks_df, chunks_path = None, None
+    for name in ('chunks_with_embeddings.parquet', 'chunks.parquet'):
+        if name in processed_files:
+            chunks_path = os.path.join('data/processed', name)
+            chunks_df = load_chunks_df(chunks_path)
+            break
+
+    _INDEX, _CHUNKS_DF = index, chunks_df
+    if index is not None and chunks_df is not None:
+        # Precalentar el modelo de embeddings mientras el usuario elige proveedor / escribe
+        threading.Thread(target=_warmup_retrieval, daemon=True).start()
+    # El prompt del sistema es constante durante la sesión: se construye una sola vez
+    system_prompt = get_system_prompt()
 
     if index is None or chunks_df is None:
         print("\n[Info] No se encontró el índice FAISS o los chunks procesados.")
@@ -80,66 +374,7 @@ def main():
     if provider_key == 'compare':
         comp_q = input("Consulta para comparar (se enviará a ChatGPT y DeepSeek): ").strip()
         if comp_q:
-            # Recuperación de contexto una sola vez
-            try:
-                t_retr0 = time.time()
-                retrieved_chunks = retrieve(comp_q, index, chunks_df, args.k)
-                t_retr = time.time() - t_retr0
-            except FileNotFoundError:
-                retrieved_chunks = []
-                t_retr = 0.0
-
-            context_docs = []
-            for chunk in retrieved_chunks:
-                context_docs.append({
-                    'content': getattr(chunk, 'content', ''),
-                    'source': getattr(chunk, 'source', ''),
-                    'page': getattr(chunk, 'page', None),
-                    'score': getattr(chunk, 'score', None)
-                })
-
-            user_prompt = build_user_prompt(comp_q, context_docs)
-            system_prompt = get_system_prompt()
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ]
-
-            comparisons = []
-            for key in ('deepseek', 'chatgpt'):
-                prov = _instantiate_provider(key)
-                start = time.time()
-                try:
-                    ans = prov.chat(messages)
-                except Exception as e:
-                    ans = f"[Error proveedor] {e}"
-                elapsed = time.time() - start
-                comparisons.append({
-                    'label': key.upper(),
-                    'model': prov.name,
-                    'time': elapsed,
-                    'answer': ans,
-                })
-
-            fastest = min(comparisons, key=lambda x: x['time'])
-            slowest = max(comparisons, key=lambda x: x['time'])
-
-            print("\n" + "="*80)
-            print("🔍 COMPARACIÓN DE RESPUESTAS")
-            print(f"Pregunta: {comp_q}")
-            print("="*80 + "\n")
-            for comp in comparisons:
-                print(f"🤖 {comp['label']}")
-                print(f"Modelo: {comp['model']}")
-                print(f"Tiempo: {comp['time']:.2f}s")
-                print("-"*40)
-                print(comp['answer'])
-                print("-"*40 + "\n")
-            print("📊 ESTADÍSTICAS:")
-            print(f"Más rápido: {fastest['time']:.2f}s ({fastest['model']})")
-            print(f"Más lento: {slowest['time']:.2f}s ({slowest['model']})")
-            print("(Retrieve común): {:.2f}s".format(t_retr))
-            print()
+            _do_compare(comp_q, args.k, system_prompt)
 
         # Después de comparar, pedir proveedor para el chat
         provider_key = _prompt_provider_choice()
@@ -152,10 +387,20 @@ def main():
         from eval.quality_evaluator import QualityEvaluator
         evaluator = QualityEvaluator(gold_set_path=args.gold, k=args.k)
         evaluator.rag_engine.set_provider(provider)
-        metrics = evaluator.run_and_save(provider, provider.name)
+        metrics = asyncio.run(evaluator.arun_and_save(provider, provider.name, concurrency=args.concurrency))
         print("Resumen evaluación:", metrics)
         return
 
+    # Caché semántica de respuestas (opcional, persistida entre sesiones); se invalida al re-indexar
+    semantic_cache = None
+    if os.getenv("SEMANTIC_CACHE_ENABLE", "0") == "1" and not args.no_cache:
+        semantic_cache = SemanticCache(
+            threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+            ttl=float(os.getenv("SEMANTIC_CACHE_TTL", "86400")),
+            fingerprint=data_fingerprint(index_path, chunks_path),
+        )
+        semantic_cache.load()
+
     # Modo interactivo
     print("Escribe 'exit' para salir. Comandos: /prov (cambiar) | /compare (comparar) | 4 (comparar) | /deepseek | /chatgpt")
     while True:
@@ -164,20 +409,20 @@ def main():
         except (EOFError, KeyboardInterrupt):
             break
 
-        if query.strip().lower() in ('exit', 'salir', 'quit'):
+        ql = query.strip().lower()
+        if ql in _EXIT_KEYS:
             break
 
         # Comando para cambiar de proveedor en cualquier momento
-        if query.strip().lower() in ("/prov", "/provider", "/cambiar"):
+        if ql in _PROV_COMMANDS:
             provider_key = _prompt_provider_choice()
             provider = _instantiate_provider(provider_key)
             print(f"Proveedor seleccionado: {provider.name}")
             continue
 
         # Comando de comparación rápida entre DeepSeek y ChatGPT
-        ql = query.strip().lower()
-        if ql.startswith('/compare') or ql == 'compare' or ql == '4':
-            if ql in ('/compare', 'compare', '4'):
+        if ql.startswith('/compare') or ql in _COMPARE_COMMANDS:
+            if ql in _COMPARE_COMMANDS:
                 comp_q = input("Consulta para comparar (se enviará a ChatGPT y DeepSeek): ").strip()
             else:
                 parts = query.split(' ', 1)
@@ -186,256 +431,51 @@ def main():
                 print("Uso: /compare <pregunta>")
                 continue
 
-            # Recuperación de contexto una sola vez
-            try:
-                t_retr0 = time.time()
-                retrieved_chunks = retrieve(comp_q, index, chunks_df, args.k)
-                t_retr = time.time() - t_retr0
-            except FileNotFoundError:
-                retrieved_chunks = []
-                t_retr = 0.0
-
-            context_docs = []
-            for chunk in retrieved_chunks:
-                context_docs.append({
-                    'content': getattr(chunk, 'content', ''),
-                    'source': getattr(chunk, 'source', ''),
-                    'page': getattr(chunk, 'page', None),
-                    'score': getattr(chunk, 'score', None)
-                })
-
-            user_prompt = build_user_prompt(comp_q, context_docs)
-            system_prompt = get_system_prompt()
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ]
-
-            # Ejecutar con DeepSeek y ChatGPT 
-            comparisons = []
-            for key in ('deepseek', 'chatgpt'):
-                prov = _instantiate_provider(key)
-                start = time.time()
-                try:
-                    ans = prov.chat(messages)
-                except Exception as e:
-                    ans = f"[Error proveedor] {e}"
-                elapsed = time.time() - start
-                comparisons.append({
-                    'label': key.upper(),
-                    'model': prov.name,
-                    'time': elapsed,
-                    'answer': ans,
-                })
-
-            # Determinar más rápido / más lento
-            fastest = min(comparisons, key=lambda x: x['time'])
-            slowest = max(comparisons, key=lambda x: x['time'])
-
-            # Render
-            print("\n" + "="*80)
-            print("🔍 COMPARACIÓN DE RESPUESTAS")
-            print(f"Pregunta: {comp_q}")
-            print("="*80 + "\n")
-
-            for comp in comparisons:
-                print(f"🤖 {comp['label']}")
-                print(f"Modelo: {comp['model']}")
-                print(f"Tiempo: {comp['time']:.2f}s")
-                print("-"*40)
-                print(comp['answer'])
-                print("-"*40 + "\n")
-
-            print("📊 ESTADÍSTICAS:")
-            print(f"Más rápido: {fastest['time']:.2f}s ({fastest['model']})")
-            print(f"Más lento: {slowest['time']:.2f}s ({slowest['model']})")
-            print("(Retrieve común): {:.2f}s".format(t_retr))
-            print()
-            continue
-
-        # Comando para forzar DeepSeek en una sola consulta
-        if ql.startswith('/deepseek'):
-            parts = query.split(' ', 1)
-            dq = parts[1].strip() if len(parts) > 1 else ''
-            if not dq:
-                dq = input("Consulta para DeepSeek: ").strip()
-                if not dq:
-                    continue
-
-            # Recuperación
-            try:
-                t_retr0 = time.time()
-                d_chunks = retrieve(dq, index, chunks_df, args.k)
-                d_retr = time.time() - t_retr0
-            except FileNotFoundError as e:
-                print(f"[RAG deshabilitado] {e}")
-                d_chunks, d_retr = [], 0.0
-            d_docs = [{
-                'content': getattr(c, 'content', ''),
-                'source': getattr(c, 'source', ''),
-                'page': getattr(c, 'page', None),
-                'score': getattr(c, 'score', None)
-            } for c in d_chunks]
-            d_user = build_user_prompt(dq, d_docs)
-            d_system = get_system_prompt()
-            d_messages = [{"role":"system","content":d_system},{"role":"user","content":d_user}]
-
-            # Chat con DeepSeek
-            from providers.deepseek import DeepSeekProvider
-            try:
-                dsp = DeepSeekProvider()
-            except Exception as e:
-                print(f"[DeepSeek no disponible] {e}")
-                print("Sugerencia: configura DEEPSEEK_API_KEY en tu .env o usa /chatgpt")
-                continue
-            try:
-                t0 = time.time()
-                d_ans = dsp.chat(d_messages)
-                d_chat = time.time() - t0
-            except Exception as e:
-                d_ans, d_chat = f"[Error proveedor] {e}", 0.0
-
-            print(f"\n[DeepSeek] Respuesta:\n{d_ans}\n")
-            def _approx_tokens(text: str) -> int:
-                return max(1, len(text)//4)
-            d_tin = _approx_tokens(str(d_messages)); d_tout = _approx_tokens(d_ans)
-            try:
-                d_cost = dsp.estimate_cost(d_tin, d_tout)
-            except Exception:
-                d_cost = 0.0
-            print("[Stats]")
-            print(f"  Proveedor: {dsp.name}")
-            print(f"  k: {args.k} | Chunks recuperados: {len(d_chunks)}")
-            print(f"  Latencia retrieve: {d_retr:.3f}s | Latencia chat: {d_chat:.3f}s")
-            print(f"  Tokens aprox IN: {d_tin} | OUT: {d_tout} | Costo estimado: ${d_cost:.6f}")
-            print()
+            _do_compare(comp_q, args.k, system_prompt)
             continue
 
-        # Comando para forzar ChatGPT en una sola consulta
-        if ql.startswith('/chatgpt'):
+        # Comandos para forzar un proveedor en una sola consulta: /deepseek | /chatgpt
+        forced = next((key for key in _FORCED_PROVIDERS if ql.startswith('/' + key)), None)
+        if forced:
+            label, hint = _FORCED_PROVIDERS[forced]
             parts = query.split(' ', 1)
-            cq = parts[1].strip() if len(parts) > 1 else ''
-            if not cq:
-                cq = input("Consulta para ChatGPT: ").strip()
-                if not cq:
+            fq = parts[1].strip() if len(parts) > 1 else ''
+            if not fq:
+                fq = input(f"Consulta para {label}: ").strip()
+                if not fq:
                     continue
-
-            # Recuperación
             try:
-                t_retr0 = time.time()
-                c_chunks = retrieve(cq, index, chunks_df, args.k)
-                c_retr = time.time() - t_retr0
-            except FileNotFoundError as e:
-                print(f"[RAG deshabilitado] {e}")
-                c_chunks, c_retr = [], 0.0
-            c_docs = [{
-                'content': getattr(c, 'content', ''),
-                'source': getattr(c, 'source', ''),
-                'page': getattr(c, 'page', None),
-                'score': getattr(c, 'score', None)
-            } for c in c_chunks]
-            c_user = build_user_prompt(cq, c_docs)
-            c_system = get_system_prompt()
-            c_messages = [{"role":"system","content":c_system},{"role":"user","content":c_user}]
-
-            # Chat con ChatGPT
-            from providers.chatgpt import ChatGPTProvider
-            try:
-                csp = ChatGPTProvider()
+                forced_provider = _get_provider(forced)
             except Exception as e:
-                print(f"[ChatGPT no disponible] {e}")
-                print("Sugerencia: configura OPENROUTER_API_KEY u OPENAI_API_KEY en tu .env o usa /deepseek")
+                print(f"[{label} no disponible] {e}")
+                print(f"Sugerencia: {hint}")
                 continue
-            try:
-                t0 = time.time()
-                c_ans = csp.chat(c_messages)
-                c_chat = time.time() - t0
-            except Exception as e:
-                c_ans, c_chat = f"[Error proveedor] {e}", 0.0
-
-            print(f"\n[ChatGPT] Respuesta:\n{c_ans}\n")
-            def _approx_tokens(text: str) -> int:
-                return max(1, len(text)//4)
-            c_tin = _approx_tokens(str(c_messages)); c_tout = _approx_tokens(c_ans)
-            try:
-                c_cost = csp.estimate_cost(c_tin, c_tout)
-            except Exception:
-                c_cost = 0.0
-            print("[Stats]")
-            print(f"  Proveedor: {csp.name}")
-            print(f"  k: {args.k} | Chunks recuperados: {len(c_chunks)}")
-            print(f"  Latencia retrieve: {c_retr:.3f}s | Latencia chat: {c_chat:.3f}s")
-            print(f"  Tokens aprox IN: {c_tin} | OUT: {c_tout} | Costo estimado: ${c_cost:.6f}")
+            stats = _run_single(forced_provider, fq, args.k, system_prompt,
+                                label=f"[{label}] Respuesta", semantic_cache=semantic_cache)
+            _print_stats(stats, args.k)
             print()
             continue
 
-        # Recuperación de contexto 
-        t_start = time.time()
-        try:
-            t_retr0 = time.time()
-            retrieved_chunks = retrieve(query, index, chunks_df, args.k)
-            t_retr = time.time() - t_retr0
-        except FileNotFoundError as e:
-            print(f"[RAG deshabilitado] {e}")
-            retrieved_chunks = []
-            t_retr = 0.0
-        context_docs = []
-        for chunk in retrieved_chunks:
-            context_docs.append({
-                'content': getattr(chunk, 'content', ''),
-                'source': getattr(chunk, 'source', ''),
-                'page': getattr(chunk, 'page', None),
-                'score': getattr(chunk, 'score', None)
-            })
-
-        # Construir mensajes y solicitar respuesta
-        user_prompt = build_user_prompt(query, context_docs)
-        system_prompt = get_system_prompt()
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ]
-        # Llamada al proveedor y medición de latencia
-        try:
-            t_chat0 = time.time()
-            response = provider.chat(messages)
-            t_chat = time.time() - t_chat0
-        except Exception as e:
-            response = f"[Error proveedor] {e}"
-            t_chat = 0.0
-        print(f"\nRespuesta:\n{response}\n")
-
-        # Stats mínimas: latencias, tokens aprox y costo estimado
-        def _approx_tokens(text: str) -> int:
-            return max(1, len(text) // 4)
-
-        tokens_in = _approx_tokens(str(messages))
-        tokens_out = _approx_tokens(response)
-        try:
-            cost_est = provider.estimate_cost(tokens_in, tokens_out)
-        except Exception:
-            cost_est = 0.0
-        t_total = time.time() - t_start
-
-        print("[Stats] ")
-        print(f"  Proveedor: {provider.name}")
-        print(f"  k: {args.k} | Chunks recuperados: {len(retrieved_chunks)}")
-        print(f"  Latencia retrieve: {t_retr:.3f}s | Latencia chat: {t_chat:.3f}s | Total: {t_total:.3f}s")
-        print(f"  Tokens aprox IN: {tokens_in} | OUT: {tokens_out} | Costo estimado: ${cost_est:.6f}")
+        # Consulta con el proveedor activo
+        stats = _run_single(provider, query, args.k, system_prompt, semantic_cache=semantic_cache)
+        _print_stats(stats, args.k)
 
         # Ofrecer cambio de proveedor tras cada respuesta
         change = input("¿Cambiar de proveedor? [Enter=No] | [1]=ChatGPT | [2]=DeepSeek | [3]=Mock] ").strip().lower()
-        if change in ("1", "chatgpt", "gpt", "openai", "sí", "si"):
+        if change in _CHATGPT_KEYS or change in _YES_KEYS:
             provider_key = 'chatgpt'
-        elif change in ("2", "deepseek", "ds"):
+        elif change in _DEEPSEEK_KEYS:
             provider_key = 'deepseek'
-        elif change in ("3", "mock", "m"):
+        elif change in _MOCK_KEYS:
             provider_key = 'mock'
         else:
             continue
         provider = _instantiate_provider(provider_key)
         print(f"Proveedor seleccionado: {provider.name}")
 
+    if semantic_cache is not None:
+        semantic_cache.save()
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,23 +1,31 @@
 from __future__ import annotations
 
+import asyncio
 import csv
-import json
+import itertools
 import os
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Optional
 
-from rag.retrieve import retrieve
+import orjson
+
+from providers.tokens import count_tokens
+from rag.retrieve import get_index_and_chunks, retrieve_batch
 from rag.prompts import build_user_prompt, get_system_prompt
 
 
 REF_SECTION_RE = re.compile(r"Referencias:\s*(.*)", re.IGNORECASE | re.DOTALL)
+# Limpieza del nombre de la fuente en un solo paso (equivale a quitar '.pdf' y 'data/raw/')
+_SRC_CLEAN_RE = re.compile(r"\.pdf|data/raw/")
 
-
-def _approx_tokens(text: str) -> int:
-    return max(1, len(text) // 4)
+# Preguntas del gold set por lote de recuperación (un encode + una búsqueda FAISS por lote)
+RETRIEVAL_BATCH = 64
+# Lotes recuperados que pueden esperar en cola mientras el proveedor responde los anteriores
+PREFETCH_BATCHES = 2
 
 
 def _extract_references(text: str) -> str:
@@ -28,13 +36,13 @@ def _extract_references(text: str) -> str:
 
 
 def _format_references_from_docs(docs: List[Dict[str, Any]], max_refs: int = 3) -> str:
-    refs = []
-    for d in docs[:max_refs]:
-        src = d.get('source') or d.get('doc_id') or d.get('doc') or 'Documento'
-        name = str(src).replace('.pdf', '').replace('data/raw/', '').strip()
-        page = d.get('page') or d.get('page_number') or 'N/A'
-        refs.append(f"[{name}, p.{page}]")
-    return "\n".join(refs)
+    return "\n".join(
+        "[{}, p.{}]".format(
+            _SRC_CLEAN_RE.sub('', str(d.get('source') or d.get('doc_id') or d.get('doc') or 'Documento')).strip(),
+            d.get('page') or d.get('page_number') or 'N/A',
+        )
+        for d in docs[:max_refs]
+    )
 
 
 @dataclass
@@ -62,78 +70,126 @@ class QualityEvaluator:
         self.k = k
         self.rag_engine = _DummyEngine()
 
-    def _load_gold(self) -> List[Dict[str, Any]]:
-        items: List[Dict[str, Any]] = []
-        with open(self.gold_set_path, 'r', encoding='utf-8') as f:
+    def _iter_gold(self) -> Iterator[Dict[str, Any]]:
+        """Lee el gold set JSONL línea a línea; la evaluación empieza sin cargar el archivo completo."""
+        # orjson parsea bytes directamente, sin decodificar cada línea a str
+        with open(self.gold_set_path, 'rb') as f:
             for line in f:
                 if line.strip():
-                    items.append(json.loads(line))
-        return items
-
-    def evaluate_provider(self, provider, provider_name: str) -> List[EvalResult]:
-        gold = self._load_gold()
-        results: List[EvalResult] = []
-
-        for item in gold:
-            q = item.get('question', '')
-
-            # Recuperación de contexto
-            start = time.time()
-            docs = retrieve(q, k=self.k)
-            ctx_docs = [{
-                'content': getattr(c, 'content', ''),
-                'source': getattr(c, 'source', ''),
-                'page': getattr(c, 'page', None),
-                'score': getattr(c, 'score', None)
-            } for c in docs]
-
-            # Construir mensajes
+                    yield orjson.loads(line)
+
+    def _prepare_batch(self, questions: List[str]):
+        """Recupera contexto para todas las preguntas en un solo lote y construye sus mensajes.
+
+        El tiempo de recuperación del lote se reparte por igual entre las preguntas.
+        """
+        start = time.perf_counter()
+        index, chunks_df = get_index_and_chunks()
+        all_docs = retrieve_batch(questions, index=index, chunks_df=chunks_df, k=self.k, as_dict=True)
+        t_retr = (time.perf_counter() - start) / max(1, len(questions))
+
+        prepared = []
+        system_prompt = get_system_prompt()
+        # El system prompt es constante: se tokeniza una vez y por pregunta solo el user prompt
+        # (mismo total que count_message_tokens: +4 tokens por mensaje)
+        sys_tokens = count_tokens(system_prompt) + 4
+        for q, ctx_docs in zip(questions, all_docs):
             user_prompt = build_user_prompt(q, ctx_docs)
-            system_prompt = get_system_prompt()
             messages = [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
             ]
+            tokens_in = sys_tokens + count_tokens(user_prompt) + 4
+            prepared.append((ctx_docs, messages, tokens_in, t_retr))
+        return prepared
+
+    def _build_result(self, item: Dict[str, Any], provider, provider_name: str,
+                      ctx_docs: List[Dict[str, Any]], tokens_in: int,
+                      answer: str, latency: float) -> EvalResult:
+        # Asegurar bloque de Referencias al final si falta
+        refs_text = _extract_references(answer)
+        if not refs_text:
+            refs_text = _format_references_from_docs(ctx_docs)
+            answer = answer.rstrip() + "\n\nReferencias:\n" + refs_text
+
+        # Estimación de costo (tokens)
+        tokens_out = count_tokens(answer)
+        try:
+            cost = provider.estimate_cost(tokens_in, tokens_out)
+        except Exception:
+            cost = 0.0
+
+        # Exact match simple (si hay 'answer' en gold)
+        gold_answer = item.get('answer', '').strip().lower()
+        exact = False
+        if gold_answer:
+            exact = gold_answer in answer.strip().lower()
+
+        return EvalResult(
+            question=item.get('question', ''),
+            provider=provider_name,
+            answer=answer,
+            references=refs_text,
+            latency_sec=latency,
+            est_cost_usd=cost,
+            exact_match=exact,
+        )
 
-            # Llamada al proveedor
-            try:
-                answer = provider.chat(messages)
-            except Exception as e:
-                answer = f"[Error proveedor] {e}"
-
-            latency = time.time() - start
-
-            # Asegurar bloque de Referencias al final si falta
-            refs_text = _extract_references(answer)
-            if not refs_text:
-                refs_text = _format_references_from_docs(ctx_docs)
-                answer = answer.rstrip() + "\n\nReferencias:\n" + refs_text
-
-            # Estimación de costo (tokens aproximados)
-            tokens_in = _approx_tokens(str(messages))
-            tokens_out = _approx_tokens(answer)
+    def evaluate_provider(self, provider, provider_name: str) -> List[EvalResult]:
+        """Versión síncrona de aevaluate_provider (misma concurrencia acotada)."""
+        return asyncio.run(self.aevaluate_provider(provider, provider_name))
+
+    async def aevaluate_provider(self, provider, provider_name: str, concurrency: Optional[int] = None) -> List[EvalResult]:
+        """Evalúa el gold set con hasta `concurrency` llamadas al proveedor en vuelo (EVAL_PARALLELISM, por defecto 8).
+
+        Pipeline productor/consumidor: un productor lee el gold set en streaming y recupera lotes de
+        RETRIEVAL_BATCH preguntas en un hilo, dejando hasta PREFETCH_BATCHES lotes listos en una cola;
+        el consumidor lanza las llamadas remotas de cada lote y solo toma el siguiente cuando quedan
+        `concurrency` o menos pendientes, de modo que recuperación y red se solapan con memoria acotada.
+        Los resultados conservan el orden del gold set.
+        """
+        if concurrency is None:
+            concurrency = int(os.getenv("EVAL_PARALLELISM", "8"))
+        concurrency = max(1, concurrency)
+        sem = asyncio.Semaphore(concurrency)
+
+        async def _one(item, ctx_docs, messages, tokens_in, t_retr) -> EvalResult:
+            async with sem:
+                start = time.perf_counter()
+                try:
+                    answer = await provider.achat(messages)
+                except Exception as e:
+                    answer = f"[Error proveedor] {e}"
+                latency = t_retr + (time.perf_counter() - start)
+            return self._build_result(item, provider, provider_name, ctx_docs, tokens_in, answer, latency)
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=PREFETCH_BATCHES)
+
+        async def _produce() -> None:
+            gold = self._iter_gold()
             try:
-                cost = provider.estimate_cost(tokens_in, tokens_out)
-            except Exception:
-                cost = 0.0
-
-            # Exact match simple (si hay 'answer' en gold)
-            gold_answer = item.get('answer', '').strip().lower()
-            exact = False
-            if gold_answer:
-                exact = gold_answer in answer.strip().lower()
-
-            results.append(EvalResult(
-                question=q,
-                provider=provider_name,
-                answer=answer,
-                references=refs_text,
-                latency_sec=latency,
-                est_cost_usd=cost,
-                exact_match=exact,
-            ))
-
-        return results
+                while True:
+                    batch = list(itertools.islice(gold, RETRIEVAL_BATCH))
+                    if not batch:
+                        break
+                    prepared = await asyncio.to_thread(self._prepare_batch, [item.get('question', '') for item in batch])
+                    await queue.put(list(zip(batch, prepared)))
+            finally:
+                await queue.put(None)
+
+        producer = asyncio.create_task(_produce())
+        tasks: List[asyncio.Task] = []
+        pending = set()
+        while (entries := await queue.get()) is not None:
+            for item, p in entries:
+                task = asyncio.create_task(_one(item, *p))
+                tasks.append(task)
+                pending.add(task)
+            while len(pending) > concurrency:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+        await producer  # propaga errores de lectura/recuperación
+        return list(await asyncio.gather(*tasks))
 
     def calculate_aggregate_metrics(self, results: List[EvalResult]) -> Dict[str, Any]:
         if not results:
@@ -152,27 +208,45 @@ class QualityEvaluator:
         }
 
     def save_csv(self, results: List[EvalResult], out_path: str) -> None:
-        with open(out_path, 'w', newline='', encoding='utf-8') as f:
+        # Buffer de 1 MiB y writerows: menos write() y menos transiciones Python/C por fila
+        with open(out_path, 'w', newline='', encoding='utf-8', buffering=1 << 20) as f:
             w = csv.DictWriter(f, fieldnames=["question", "provider", "answer", "references"]) 
             w.writeheader()
-            for r in results:
-                w.writerow({
+            w.writerows(
+                {
                     "question": r.question,
                     "provider": r.provider,
                     "answer": r.answer,
                     "references": r.references,
-                })
+                }
+                for r in results
+            )
 
-    def save_summary(self, provider_name: str, metrics: Dict[str, Any], out_path: str) -> None:
+    def save_summary(self, provider_name: str, metrics: Dict[str, Any], out_path: str, pretty: bool = True) -> None:
         data = {"provider": provider_name, **metrics}
-        with open(out_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        with open(out_path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else 0))
 
     def run_and_save(self, provider, provider_name: str, out_dir: str = "eval") -> Dict[str, Any]:
+        results = self.evaluate_provider(provider, provider_name)
+        return self._save_all(results, provider_name, out_dir)
+
+    async def arun_and_save(self, provider, provider_name: str, out_dir: str = "eval",
+                            concurrency: Optional[int] = None) -> Dict[str, Any]:
+        results = await self.aevaluate_provider(provider, provider_name, concurrency=concurrency)
+        return self._save_all(results, provider_name, out_dir)
+
+    def _save_all(self, results: List[EvalResult], provider_name: str, out_dir: str) -> Dict[str, Any]:
         os.makedirs(out_dir, exist_ok=True)
         stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        results = self.evaluate_provider(provider, provider_name)
         metrics = self.calculate_aggregate_metrics(results)
-        self.save_csv(results, os.path.join(out_dir, f"results_{provider_name}_{stamp}.csv"))
-        self.save_summary(provider_name, metrics, os.path.join(out_dir, f"summary_{provider_name}_{stamp}.json"))
+        # Ambos archivos se escriben en paralelo para solapar el flush a disco
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [
+                pool.submit(self.save_csv, results, os.path.join(out_dir, f"results_{provider_name}_{stamp}.csv")),
+                pool.submit(self.save_summary, provider_name, metrics,
+                            os.path.join(out_dir, f"summary_{provider_name}_{stamp}.json")),
+            ]
+            for fut in futures:
+                fut.result()
         return metrics
@@ -2,9 +2,21 @@
 Proveedores de LLM para UFRO Assistant
 """
 
-from .base import BaseProvider
-from .chatgpt import ChatGPTProvider
-from .deepseek import DeepSeekProvider
-from .mock import MockProvider
+import importlib
+
+# Carga diferida: importar un proveedor no arrastra los SDKs de los demás (openai, requests)
+_EXPORTS = {
+    'BaseProvider': '.base',
+    'ChatGPTProvider': '.chatgpt',
+    'DeepSeekProvider': '.deepseek',
+    'MockProvider': '.mock',
+}
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = ['BaseProvider', 'ChatGPTProvider', 'DeepSeekProvider', 'MockProvider']
\ No newline at end of file
@@ -1,15 +1,33 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from typing import List, Dict, Iterator
+import asyncio
 import time
 
+from .tokens import count_tokens
+
+
+# Referencias a los cierres en segundo plano (asyncio solo guarda referencias débiles a las tareas)
+_CLOSING_TASKS: set = set()
+
+
+async def _aclose_quietly(client) -> None:
+    # httpx.AsyncClient expone aclose(); AsyncOpenAI, close()
+    try:
+        await (client.aclose() if hasattr(client, "aclose") else client.close())
+    except Exception:
+        pass
+
 
 class BaseProvider(ABC):
     """Interfaz base para todos los proveedores de LLM.
 
     Contrato mínimo:
     - chat(messages) -> str: retorna solo el texto de respuesta
+    - achat(messages) -> str: versión asíncrona de chat (por defecto en un hilo)
+    - stream_chat(messages) -> Iterator[str]: fragmentos de texto a medida que llegan
     - estimate_cost(input_tokens, output_tokens) -> float
     - name: propiedad legible del proveedor
+    - is_available: False si responde con un texto de relleno en lugar de llamar al modelo
     """
 
     @property
@@ -17,17 +35,43 @@ class BaseProvider(ABC):
     def name(self) -> str:
         pass
 
+    @property
+    def is_available(self) -> bool:
+        # False si el proveedor responde en modo degradado (p. ej. sin API key): esas respuestas no se cachean
+        return True
+
     @abstractmethod
     def chat(self, messages: List[Dict[str, str]], **kwargs) -> str:
         pass
 
+    async def achat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        # Por defecto ejecuta chat() en un hilo; los proveedores con cliente async pueden sobrescribirlo
+        return await asyncio.to_thread(self.chat, messages, **kwargs)
+
+    def stream_chat(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[str]:
+        # Por defecto entrega la respuesta completa como un único fragmento
+        yield self.chat(messages, **kwargs)
+
     @abstractmethod
     def estimate_cost(self, input_tokens: int, output_tokens: int = 0) -> float:
         pass
 
+    @staticmethod
+    def _close_aclient(client, old_loop: asyncio.AbstractEventLoop, loop: asyncio.AbstractEventLoop) -> None:
+        """Cierra el cliente async de un event loop anterior para no dejar su pool de conexiones abierto."""
+        if old_loop.is_running():
+            # El loop anterior sigue vivo en otro hilo: el cierre se hace en él
+            asyncio.run_coroutine_threadsafe(_aclose_quietly(client), old_loop)
+        else:
+            # Loop ya terminado (p. ej. un asyncio.run anterior): se cierra en segundo plano desde el actual
+            task = loop.create_task(_aclose_quietly(client))
+            _CLOSING_TASKS.add(task)
+            task.add_done_callback(_CLOSING_TASKS.discard)
+
     def _measure_latency(self, start_time: float) -> float:
-        return time.time() - start_time
+        # start_time debe venir de time.perf_counter() (monótono, alta resolución)
+        return time.perf_counter() - start_time
 
     def _count_tokens_approximate(self, text: str) -> int:
-        # Aproximación muy simple para evitar dependencia de tokenizadores
-        return max(1, len(text) // 4)
+        # tiktoken cl100k_base (con caché por texto)
+        return count_tokens(text)
@@ -1,8 +1,33 @@
+import asyncio
+import atexit
+import importlib.util
 import os
 import time
-from typing import Dict, List, Any
-from openai import OpenAI
+from typing import Dict, List, Any, Iterator
+import httpx
+from openai import AsyncOpenAI, OpenAI
 from .base import BaseProvider
+from .response_cache import cached_chat
+from .tokens import count_message_tokens, count_tokens
+
+
+def _http_client_options() -> Dict[str, Any]:
+    # HTTP/2 (multiplexado) solo si 'h2' está instalado
+    return {
+        "http2": importlib.util.find_spec("h2") is not None,
+        "limits": httpx.Limits(max_connections=32, max_keepalive_connections=32),
+        "timeout": float(os.getenv("REQUEST_TIMEOUT", "60")),
+    }
+
+
+def _build_http_client() -> httpx.Client:
+    """Cliente HTTP compartido: reutiliza conexiones TLS y multiplexa con HTTP/2 si 'h2' está instalado."""
+    return httpx.Client(**_http_client_options())
+
+
+# Un solo pool de conexiones para todas las instancias del proveedor
+_HTTP_CLIENT = _build_http_client()
+atexit.register(_HTTP_CLIENT.close)
 
 
 class ChatGPTProvider(BaseProvider):
@@ -21,37 +46,67 @@ class ChatGPTProvider(BaseProvider):
         self.model = model
 
         # Configurar cliente 
+        self.base_url = os.getenv("OPENAI_BASE_URL", "https://openrouter.ai/api/v1")
         self.client = None
         if self.api_key:
             self.client = OpenAI(
                 api_key=self.api_key,
-                base_url=os.getenv("OPENAI_BASE_URL", "https://openrouter.ai/api/v1")
+                base_url=self.base_url,
+                http_client=_HTTP_CLIENT,
             )
+        # Cliente async: se crea por event loop (httpx no reutiliza conexiones entre loops)
+        self._aclient = None
+        self._aclient_loop = None
 
     @property
     def name(self) -> str:
         return f"ChatGPT ({self.model})"
 
+    @property
+    def is_available(self) -> bool:
+        return self.client is not None
+
+    def _disabled_result(self, messages: List[Dict[str, str]], start_time: float) -> Dict[str, Any]:
+        # Modo degradado: sin API key devuelve respuesta estática útil para pruebas
+        latency = self._measure_latency(start_time)
+        dummy = "[ChatGPT deshabilitado: falta API key]"
+        tokens_in = count_message_tokens(messages)
+        tokens_out = count_tokens(dummy)
+        return {
+            "response": dummy,
+            "input_tokens": tokens_in,
+            "output_tokens": tokens_out,
+            "total_tokens": tokens_in + tokens_out,
+            "latency": latency,
+            "cost": 0.0,
+            "model": self.model,
+        }
+
+    def _completion_result(self, response, start_time: float) -> Dict[str, Any]:
+        latency = self._measure_latency(start_time)
+
+        input_tokens = response.usage.prompt_tokens if response.usage else 0
+        output_tokens = response.usage.completion_tokens if response.usage else 0
+        total_tokens = response.usage.total_tokens if response.usage else 0
+        cost = self.estimate_cost(input_tokens, output_tokens)
+
+        return {
+            "response": response.choices[0].message.content,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": total_tokens,
+            "latency": latency,
+            "cost": cost,
+            "model": self.model,
+        }
+
     def chat_detailed(self, messages: List[Dict[str, str]], **kwargs) -> Dict[str, Any]:
         """Envía solicitud de chat completion a OpenAI y retorna metadatos."""
-        start_time = time.time()
+        start_time = time.perf_counter()
 
         try:
             if not self.client:
-                # Modo degradado: sin API key devuelve respuesta estática útil para pruebas
-                latency = self._measure_latency(start_time)
-                dummy = "[ChatGPT deshabilitado: falta API key]"
-                tokens_in = max(1, len(str(messages)) // 4)
-                tokens_out = len(dummy) // 4
-                return {
-                    "response": dummy,
-                    "input_tokens": tokens_in,
-                    "output_tokens": tokens_out,
-                    "total_tokens": tokens_in + tokens_out,
-                    "latency": latency,
-                    "cost": 0.0,
-                    "model": self.model,
-                }
+                return self._disabled_result(messages, start_time)
 
             response = self.client.chat.completions.create(
                 model=self.model,
@@ -59,24 +114,45 @@ class ChatGPTProvider(BaseProvider):
                 temperature=kwargs.get("temperature", 0.2),
                 max_tokens=kwargs.get("max_tokens", 1500),
             )
+            return self._completion_result(response, start_time)
 
-            latency = self._measure_latency(start_time)
-
-            input_tokens = response.usage.prompt_tokens if response.usage else 0
-            output_tokens = response.usage.completion_tokens if response.usage else 0
-            total_tokens = response.usage.total_tokens if response.usage else 0
-            cost = self.estimate_cost(input_tokens, output_tokens)
-
+        except Exception as e:
             return {
-                "response": response.choices[0].message.content,
-                "input_tokens": input_tokens,
-                "output_tokens": output_tokens,
-                "total_tokens": total_tokens,
-                "latency": latency,
-                "cost": cost,
-                "model": self.model,
+                "error": str(e),
+                "latency": self._measure_latency(start_time),
+                "cost": 0.0,
             }
 
+    def _get_aclient(self) -> AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            if self._aclient is not None:
+                self._close_aclient(self._aclient, self._aclient_loop, loop)
+            # Mismos límites, HTTP/2 y timeout que el cliente síncrono compartido
+            self._aclient = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=httpx.AsyncClient(**_http_client_options()),
+            )
+            self._aclient_loop = loop
+        return self._aclient
+
+    async def achat_detailed(self, messages: List[Dict[str, str]], **kwargs) -> Dict[str, Any]:
+        """Versión async de chat_detailed con AsyncOpenAI: no bloquea el event loop."""
+        start_time = time.perf_counter()
+
+        try:
+            if not self.api_key:
+                return self._disabled_result(messages, start_time)
+
+            response = await self._get_aclient().chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=kwargs.get("temperature", 0.2),
+                max_tokens=kwargs.get("max_tokens", 1500),
+            )
+            return self._completion_result(response, start_time)
+
         except Exception as e:
             return {
                 "error": str(e),
@@ -93,9 +169,41 @@ class ChatGPTProvider(BaseProvider):
             return input_cost + output_cost
         return 0.0
 
+    def stream_chat(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[str]:
+        """Envía la solicitud con stream=True y entrega los fragmentos de texto a medida que llegan."""
+        if not self.client:
+            yield "[ChatGPT deshabilitado: falta API key]"
+            return
+
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=kwargs.get("temperature", 0.2),
+                max_tokens=kwargs.get("max_tokens", 1500),
+                stream=True,
+            )
+        except Exception as e:
+            raise RuntimeError(str(e)) from e
+
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
     # Implementación de BaseProvider que retorna solo el texto
+    @cached_chat
     def chat(self, messages: List[Dict[str, str]], **kwargs) -> str:
         result = self.chat_detailed(messages, **kwargs)
         if "error" in result:
             raise RuntimeError(result["error"])  
         return result.get("response", "")
+
+    @cached_chat
+    async def achat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        result = await self.achat_detailed(messages, **kwargs)
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        return result.get("response", "")
@@ -1,10 +1,15 @@
+import asyncio
 import os
-import time
+import httpx
+import orjson
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from typing import List, Dict, Any
+from typing import Any, Dict, Iterator, List
 from .base import BaseProvider
+from .rate_limit import shared_bucket_from_env
+from .response_cache import cached_chat
+from .tokens import count_message_tokens
 
 
 class DeepSeekProvider(BaseProvider):
@@ -39,7 +44,8 @@ class DeepSeekProvider(BaseProvider):
         
         if not self.api_key:
             raise ValueError("DEEPSEEK_API_KEY no está configurado en el archivo .env")
-        # Sesión con reintentos simples para errores transitorios
+        # Sesión con reintentos simples para errores transitorios; el pool mantiene conexiones
+        # keep-alive para solicitudes concurrentes (p. ej. achat en hilos durante la evaluación)
         self.session = requests.Session()
         retries = Retry(
             total=3,
@@ -48,64 +54,110 @@ class DeepSeekProvider(BaseProvider):
             allowed_methods=["POST"],
             raise_on_status=False,
         )
-        self.session.mount("https://", HTTPAdapter(max_retries=retries))
-        self.session.mount("http://", HTTPAdapter(max_retries=retries))
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retries)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Cabeceras fijas en la sesión: no se reconstruyen en cada solicitud
+        self.session.headers.update({
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        })
+
+        # Cliente async: se crea por event loop en _get_aclient
+        self._aclient = None
+        self._aclient_loop = None
+
+        # Límites de cuota opcionales (solicitudes y tokens por minuto); sin definir = sin límite
+        # (compartidos en el proceso por endpoint y API key)
+        self._rpm_bucket = shared_bucket_from_env(("rpm", self.endpoint, self.api_key), os.getenv("DEEPSEEK_RPM"))
+        self._tpm_bucket = shared_bucket_from_env(("tpm", self.endpoint, self.api_key), os.getenv("DEEPSEEK_TPM"))
 
         # Validar modelo
         if self.model not in self.SUPPORTED_MODELS:
             print(f"⚠  Modelo {self.model} no está en la lista de modelos probados")
 
+        # Precios por token y nombre visible precalculados (estimate_cost se llama en cada respuesta)
+        info = self.SUPPORTED_MODELS.get(self.model)
+        if info is not None:
+            self._input_price_per_token = info["input"] / 1000.0
+            self._output_price_per_token = info["output"] / 1000.0
+        else:
+            # Fallback para modelos no listados: solo entrada, 0.10 USD por millón
+            self._input_price_per_token = 0.10 / 1_000_000
+            self._output_price_per_token = 0.0
+        self._display_name = f"deepseek ({(info or {}).get('name', self.model)})"
+
     @property
     def name(self) -> str:
-        model_name = self.SUPPORTED_MODELS.get(self.model, {}).get("name", self.model)
-        return f"deepseek ({model_name})"
+        return self._display_name
 
-    def chat(self, messages: List[Dict[str, str]], **kwargs) -> str:
-        """Envía solicitud de chat completion a DeepSeek."""
-        start_time = time.time()
-        
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
+    def _payload(self, messages: List[Dict[str, str]], **kwargs) -> Dict[str, Any]:
+        return {
             "model": self.model,
             "messages": messages,
             "temperature": kwargs.get("temperature", self.default_temperature),
             "max_tokens": kwargs.get("max_tokens", self.default_max_tokens),
             "stream": False
         }
+
+    def _buckets_for(self, payload: Dict[str, Any]):
+        """Pares (cubo, cantidad) a reservar antes de enviar el payload."""
+        pairs = []
+        if self._rpm_bucket is not None:
+            pairs.append((self._rpm_bucket, 1))
+        if self._tpm_bucket is not None:
+            # Peor caso: tokens de entrada + max_tokens de salida
+            pairs.append((self._tpm_bucket, count_message_tokens(payload["messages"]) + payload["max_tokens"]))
+        return pairs
+
+    def _throttle(self, payload: Dict[str, Any]) -> None:
+        for bucket, amount in self._buckets_for(payload):
+            bucket.acquire(amount)
+
+    async def _athrottle(self, payload: Dict[str, Any]) -> None:
+        for bucket, amount in self._buckets_for(payload):
+            await bucket.aacquire(amount)
+
+    def _parse_response(self, response) -> str:
+        """Mapea errores HTTP y extrae el texto (sirve para respuestas de requests y de httpx)."""
+        # Manejo especifico de errores HTTP
+        if response.status_code == 401:
+            raise RuntimeError("Error de autenticación (401): Verifica tu DEEPSEEK_API_KEY")
+        elif response.status_code == 400:
+            error_data = orjson.loads(response.content).get("error", {})
+            error_msg = error_data.get("message", response.text)
+            raise RuntimeError(f"Error en la solicitud (400): {error_msg}")
+        elif response.status_code == 429:
+            # El proveedor ya está limitando: bajar la tasa propia un 20% durante 30 s
+            for bucket in (self._rpm_bucket, self._tpm_bucket):
+                if bucket is not None:
+                    bucket.penalize()
+            raise RuntimeError("Rate limit (429): Demasiadas solicitudes a DeepSeek")
+        elif response.status_code == 500:
+            raise RuntimeError("Error interno del servidor (500) en DeepSeek")
+        elif response.status_code == 503:
+            raise RuntimeError("Servicio no disponible (503) en DeepSeek")
         
+        response.raise_for_status()
+        result = orjson.loads(response.content)
+
+        if "choices" not in result or not result.get("choices"):
+            raise RuntimeError(f"Respuesta vacia de DeepSeek: {result}")
+        
+        return result["choices"][0]["message"]["content"]
+
+    @cached_chat
+    def chat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        """Envía solicitud de chat completion a DeepSeek."""
+        payload = self._payload(messages, **kwargs)
+        self._throttle(payload)
         try:
             response = self.session.post(
                 self.endpoint,
-                headers=headers, 
-                json=payload,
+                data=orjson.dumps(payload),
                 timeout=self.request_timeout
             )
-            
-            # Manejo especifico de errores HTTP
-            if response.status_code == 401:
-                raise RuntimeError("Error de autenticación (401): Verifica tu DEEPSEEK_API_KEY")
-            elif response.status_code == 400:
-                error_data = response.json().get("error", {})
-                error_msg = error_data.get("message", response.text)
-                raise RuntimeError(f"Error en la solicitud (400): {error_msg}")
-            elif response.status_code == 429:
-                raise RuntimeError("Rate limit (429): Demasiadas solicitudes a DeepSeek")
-            elif response.status_code == 500:
-                raise RuntimeError("Error interno del servidor (500) en DeepSeek")
-            elif response.status_code == 503:
-                raise RuntimeError("Servicio no disponible (503) en DeepSeek")
-            
-            response.raise_for_status()
-            result = response.json()
-
-            if "choices" not in result or not result.get("choices"):
-                raise RuntimeError(f"Respuesta vacia de DeepSeek: {result}")
-            
-            return result["choices"][0]["message"]["content"]
+            return self._parse_response(response)
             
         except requests.exceptions.Timeout:
             raise RuntimeError(f"Timeout despues de {self.request_timeout} s con DeepSeek")
@@ -122,16 +174,103 @@ class DeepSeekProvider(BaseProvider):
         except Exception as e:
             raise RuntimeError(f"Error inesperado con DeepSeek: {e}")
 
+    def stream_chat(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[str]:
+        """Envía la solicitud con stream=True y entrega los fragmentos de texto (SSE) a medida que llegan."""
+        payload = self._payload(messages, **kwargs)
+        payload["stream"] = True
+        self._throttle(payload)
+        try:
+            response = self.session.post(
+                self.endpoint,
+                data=orjson.dumps(payload),
+                timeout=self.request_timeout,
+                stream=True,
+            )
+        except requests.exceptions.Timeout:
+            raise RuntimeError(f"Timeout despues de {self.request_timeout} s con DeepSeek")
+        except requests.exceptions.RequestException as e:
+            raise RuntimeError(f"Error de conexión con DeepSeek: {str(e)}")
+
+        with response:
+            if response.status_code != 200:
+                try:
+                    self._parse_response(response)
+                except requests.exceptions.HTTPError as e:
+                    raise RuntimeError(f"Error HTTP {response.status_code} con DeepSeek: {str(e)}")
+            # Formato compatible OpenAI: líneas "data: {json}" y un "data: [DONE]" final
+            for line in response.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                choices = orjson.loads(data).get("choices") or []
+                if choices:
+                    delta = (choices[0].get("delta") or {}).get("content")
+                    if delta:
+                        yield delta
+
+    def _get_aclient(self) -> httpx.AsyncClient:
+        # Un AsyncClient por event loop (sus conexiones no se pueden reutilizar entre loops)
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            if self._aclient is not None:
+                self._close_aclient(self._aclient, self._aclient_loop, loop)
+            self._aclient = httpx.AsyncClient(
+                headers=dict(self.session.headers),
+                timeout=self.request_timeout,
+                # retries: reintenta errores de conexión (equivalente parcial al Retry de la sesión)
+                transport=httpx.AsyncHTTPTransport(
+                    retries=3,
+                    limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+                ),
+            )
+            self._aclient_loop = loop
+        return self._aclient
+
+    @cached_chat
+    async def achat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        """Versión async de chat con httpx: no ocupa un hilo por solicitud en vuelo."""
+        payload = self._payload(messages, **kwargs)
+        await self._athrottle(payload)
+        try:
+            response = await self._get_aclient().post(self.endpoint, content=orjson.dumps(payload))
+            return self._parse_response(response)
+
+        except httpx.TimeoutException:
+            raise RuntimeError(f"Timeout despues de {self.request_timeout} s con DeepSeek")
+        except httpx.ConnectError:
+            raise RuntimeError("Error de conexion con DeepSeek - verifica tu internet")
+        except httpx.HTTPStatusError as e:
+            raise RuntimeError(f"Error HTTP {e.response.status_code} con DeepSeek: {str(e)}")
+        except httpx.HTTPError as e:
+            raise RuntimeError(f"Error de conexión con DeepSeek: {str(e)}")
+        except KeyError as e:
+            raise RuntimeError(f"Respuesta inesperada de DeepSeek: {e}")
+        except Exception as e:
+            raise RuntimeError(f"Error inesperado con DeepSeek: {e}")
+
+    async def chat_many(self, batch: List[List[Dict[str, str]]], concurrency: int = 8, **kwargs) -> List[str]:
+        """Envía varias conversaciones con hasta `concurrency` solicitudes en vuelo; conserva el orden.
+
+        Un error en una conversación se propaga (como en chat); usa return_exceptions en gather si
+        necesitas resultados parciales.
+        """
+        sem = asyncio.Semaphore(max(1, concurrency))
+
+        async def _one(messages):
+            async with sem:
+                return await self.achat(messages, **kwargs)
+
+        return list(await asyncio.gather(*(_one(m) for m in batch)))
+
+    def chat_many_sync(self, batch: List[List[Dict[str, str]]], concurrency: int = 8, **kwargs) -> List[str]:
+        """Versión síncrona de chat_many (no usar dentro de un event loop en ejecución)."""
+        return asyncio.run(self.chat_many(batch, concurrency=concurrency, **kwargs))
+
     def estimate_cost(self, input_tokens: int, output_tokens: int = 0) -> float:
         """Estima el costo basado en los precios de DeepSeek."""
-        if self.model in self.SUPPORTED_MODELS:
-            prices = self.SUPPORTED_MODELS[self.model]
-            input_cost = (input_tokens / 1000) * prices["input"]
-            output_cost = (output_tokens / 1000) * prices["output"]
-            return input_cost + output_cost
-        else:
-            # Fallback para modelos no listados
-            return (input_tokens / 1_000_000) * 0.10
+        return input_tokens * self._input_price_per_token + output_tokens * self._output_price_per_token
 
     def _validate_connection(self):
         """Método de compatibilidad (ya no se usa automáticamente)."""
@@ -1,33 +1,12 @@
-from typing import List, Dict, Any
+import os
+import re
+import threading
+from typing import List, Dict, Any, Optional
 from .base import BaseProvider
 
-class MockProvider(BaseProvider):
-    """
-    Proveedor Mock que simula respuestas para pruebas
-    """
-
-    def __init__(self):
-        self.model = "mock-model"
-
-    @property
-    def name(self) -> str:
-        return "Mock"
-
-    def chat(self, messages: List[Dict[str, str]], temperature: float = 0.7, max_tokens: int = 2000) -> str:
-        """
-        Simula una respuesta de chat basada en la consulta
-        """
-        # Extraer la consulta del ultimo mensaje
-        user_message = ""
-        for message in messages:
-            if message.get("role") == "user":
-                user_message = message.get("content", "")
-        
-        # Generar respuesta mock basada en palabras clave
-        query_lower = user_message.lower()
-        
-        if "matrícula" in query_lower or "matricula" in query_lower:
-            return '''Según el Reglamento de Admisión para carreras de Pregrado, "la matrícula es el acto académico mediante el cual el estudiante se incorpora oficialmente a la Universidad y a una carrera específica".
+# Respuestas simuladas por categoría de consulta
+_FAQ_ANSWERS = {
+    'matricula': '''Según el Reglamento de Admisión para carreras de Pregrado, "la matrícula es el acto académico mediante el cual el estudiante se incorpora oficialmente a la Universidad y a una carrera específica".
 
 El proceso de matrícula incluye:
 - Presentación de documentos requeridos
@@ -35,10 +14,9 @@ El proceso de matrícula incluye:
 - Inscripción de asignaturas según plan de estudios
 
 Referencias:
-[Reglamento-de-Admision-para-carreras-de-Pregrado, p.15]'''
+[Reglamento-de-Admision-para-carreras-de-Pregrado, p.15]''',
 
-        elif "nota" in query_lower or "calificación" in query_lower:
-            return '''De acuerdo al Reglamento de Régimen de Estudios 2023, "la escala de calificaciones va de 1.0 a 7.0, siendo la nota mínima de aprobación 4.0".
+    'notas': '''De acuerdo al Reglamento de Régimen de Estudios 2023, "la escala de calificaciones va de 1.0 a 7.0, siendo la nota mínima de aprobación 4.0".
 
 El sistema establece que:
 - Nota máxima: 7.0
@@ -46,10 +24,9 @@ El sistema establece que:
 - Las calificaciones se expresan con un decimal
 
 Referencias:
-[Reglamento-de-Regimen-de-Estudios-2023, p.23]'''
+[Reglamento-de-Regimen-de-Estudios-2023, p.23]''',
 
-        elif "arancel" in query_lower or "pago" in query_lower:
-            return '''Según el Reglamento de Obligaciones Financieras, "los aranceles y derechos universitarios deben cancelarse en los plazos establecidos por la Universidad".
+    'aranceles': '''Según el Reglamento de Obligaciones Financieras, "los aranceles y derechos universitarios deben cancelarse en los plazos establecidos por la Universidad".
 
 Las obligaciones financieras incluyen:
 - Arancel anual de la carrera
@@ -57,10 +34,9 @@ Las obligaciones financieras incluyen:
 - Otros cobros según corresponda
 
 Referencias:
-[Reglamento-de-Obligaciones-Financieras, p.8]'''
+[Reglamento-de-Obligaciones-Financieras, p.8]''',
 
-        elif "título" in query_lower or "titulación" in query_lower:
-            return '''El Reglamento de Actividad de Titulación establece que "para obtener el título profesional, el estudiante debe completar satisfactoriamente una actividad de titulación".
+    'titulacion': '''El Reglamento de Actividad de Titulación establece que "para obtener el título profesional, el estudiante debe completar satisfactoriamente una actividad de titulación".
 
 Los requisitos incluyen:
 - Haber aprobado todas las asignaturas del plan de estudios
@@ -68,10 +44,10 @@ Los requisitos incluyen:
 - Cumplir con requisitos administrativos
 
 Referencias:
-[Reglamento-Actividad-de-Titulacion, p.12]'''
+[Reglamento-Actividad-de-Titulacion, p.12]''',
+}
 
-        else:
-            return '''Basándome en la normativa disponible de la Universidad de La Frontera, no encontré información específica que responda exactamente a su consulta. 
+_DEFAULT_ANSWER = '''Basándome en la normativa disponible de la Universidad de La Frontera, no encontré información específica que responda exactamente a su consulta. 
 
 Le recomiendo:
 1. Revisar los reglamentos específicos según su área de interés
@@ -81,6 +57,124 @@ Le recomiendo:
 Referencias:
 [Documentos-varios-UFRO, p.N/A]'''
 
+# Palabras clave por categoría; si hay varias, gana la primera categoría de _FAQ_ANSWERS
+_KEYWORD_CATEGORY = {
+    'matrícula': 'matricula', 'matricula': 'matricula',
+    'nota': 'notas', 'calificación': 'notas',
+    'arancel': 'aranceles', 'pago': 'aranceles',
+    'título': 'titulacion', 'titulación': 'titulacion',
+}
+# Un solo recorrido del texto; el lookahead encuentra también coincidencias solapadas
+_KEYWORD_RE = re.compile("(?=(" + "|".join(map(re.escape, _KEYWORD_CATEGORY)) + "))")
+
+# Preguntas de ejemplo por categoría para el ruteo semántico (paráfrasis sin palabra clave)
+_FAQ_SEEDS = {
+    'matricula': (
+        "¿Cómo es el proceso de matrícula?",
+        "¿Cómo me inscribo como alumno nuevo en la universidad?",
+        "¿Qué documentos necesito para incorporarme a una carrera?",
+    ),
+    'notas': (
+        "¿Cuál es la escala de calificaciones?",
+        "¿Con qué nota se aprueba una asignatura?",
+        "¿Cómo me evalúan en los ramos?",
+    ),
+    'aranceles': (
+        "¿Cómo pago el arancel de la carrera?",
+        "¿Cuándo vencen las cuotas de la mensualidad?",
+        "¿Qué obligaciones financieras tengo con la universidad?",
+    ),
+    'titulacion': (
+        "¿Qué necesito para obtener mi título profesional?",
+        "¿Cómo es la actividad de titulación?",
+        "¿Qué requisitos hay para egresar?",
+    ),
+}
+
+# Línea con la pregunta original dentro del prompt construido por rag.prompts
+_QUESTION_RE = re.compile(r"^(?:CONSULTA DEL USUARIO|Pregunta):\s*(.+)$", re.MULTILINE)
+
+_ROUTER = None
+_ROUTER_LOCK = threading.Lock()
+
+
+def _build_router():
+    """Índice IP sobre los embeddings normalizados de _FAQ_SEEDS (se construye una sola vez)."""
+    import faiss
+    from rag.embedding_system import EmbeddingSystem
+
+    embedder = EmbeddingSystem(model_name=os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2"))
+    labels = [cat for cat, seeds in _FAQ_SEEDS.items() for _ in seeds]
+    vecs = embedder.embed_queries([q for seeds in _FAQ_SEEDS.values() for q in seeds])
+    faiss.normalize_L2(vecs)
+    index = faiss.IndexFlatIP(vecs.shape[1])
+    index.add(vecs)
+    return embedder, index, labels
+
+
+def _semantic_category(question: str) -> Optional[str]:
+    """Categoría cuya pregunta de ejemplo es más similar (coseno >= MOCK_SEMANTIC_THRESHOLD).
+
+    Desactivado por defecto (umbral 0). Si el modelo de embeddings no se puede cargar se
+    avisa una vez y no se vuelve a intentar.
+    """
+    global _ROUTER
+    threshold = float(os.getenv("MOCK_SEMANTIC_THRESHOLD", "0"))
+    if threshold <= 0 or not question:
+        return None
+    with _ROUTER_LOCK:
+        if _ROUTER is None:
+            try:
+                _ROUTER = _build_router()
+            except Exception as e:
+                print(f"[mock] Ruteo semántico deshabilitado: {e}")
+                _ROUTER = False
+    if not _ROUTER:
+        return None
+    try:
+        import faiss
+        embedder, index, labels = _ROUTER
+        vec = embedder.embed_text(question)
+        faiss.normalize_L2(vec)
+        D, I = index.search(vec, 1)
+    except Exception:
+        return None
+    if I[0, 0] < 0 or D[0, 0] < threshold:
+        return None
+    return labels[I[0, 0]]
+
+
+class MockProvider(BaseProvider):
+    """
+    Proveedor Mock que simula respuestas para pruebas
+    """
+
+    def __init__(self):
+        self.model = "mock-model"
+
+    @property
+    def name(self) -> str:
+        return "Mock"
+
+    def chat(self, messages: List[Dict[str, str]], temperature: float = 0.7, max_tokens: int = 2000) -> str:
+        """
+        Simula una respuesta de chat basada en la consulta
+        """
+        # Extraer la consulta del ultimo mensaje de usuario (recorriendo desde el final)
+        user_message = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        
+        # Generar respuesta mock basada en palabras clave
+        query_lower = user_message.casefold()
+        
+        found = {_KEYWORD_CATEGORY[kw] for kw in _KEYWORD_RE.findall(query_lower)}
+        category = next((cat for cat in _FAQ_ANSWERS if cat in found), None)
+        if category is None:
+            # Sin palabra clave: ruteo por similitud con la pregunta original (paráfrasis)
+            m = _QUESTION_RE.search(user_message)
+            category = _semantic_category(m.group(1).strip() if m else user_message)
+
+        return _FAQ_ANSWERS.get(category, _DEFAULT_ANSWER)
+
     # Stats simbolicos para futuros tests
     def _count_tokens_approximate(self, text: str) -> int:
         """Estimación aproximada de tokens"""
@@ -0,0 +1,87 @@
+"""
+Limitación de tasa del lado cliente (token bucket) para no exceder la cuota del proveedor.
+
+Cada llamada reserva capacidad antes de salir: si el cubo no alcanza, se espera lo justo
+en lugar de enviar la solicitud y recibir un 429. Sirve tanto para código síncrono
+(acquire, bloquea el hilo) como para async (aacquire, cede el event loop).
+"""
+
+import asyncio
+import threading
+import time
+from typing import Dict, Optional
+
+
+class TokenBucket:
+    """Cubo de `burst` unidades que se rellena a `rate_per_sec` unidades por segundo."""
+
+    def __init__(self, rate_per_sec: float, burst: float):
+        self.rate = float(rate_per_sec)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        # Reducción temporal de la tasa tras observar un 429
+        self._penalty = 1.0
+        self._penalty_until = 0.0
+
+    @classmethod
+    def per_minute(cls, amount_per_minute: float) -> "TokenBucket":
+        return cls(amount_per_minute / 60.0, amount_per_minute)
+
+    def _reserve(self, amount: float) -> float:
+        """Descuenta `amount` (puede quedar en negativo) y retorna cuántos segundos esperar."""
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._penalty_until:
+                self._penalty = 1.0
+            rate = self.rate * self._penalty
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * rate)
+            self._last = now
+            # Una solicitud mayor que el cubo completo solo espera a tenerlo lleno
+            self._tokens -= min(amount, self.burst)
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / rate
+
+    def acquire(self, amount: float = 1) -> None:
+        wait = self._reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, amount: float = 1) -> None:
+        wait = self._reserve(amount)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def penalize(self, factor: float = 0.8, duration: float = 30.0) -> None:
+        """Reduce la tasa al `factor` (acumulable) durante `duration` segundos."""
+        with self._lock:
+            self._penalty *= factor
+            self._penalty_until = time.monotonic() + duration
+
+
+def bucket_from_env(value: Optional[str]) -> Optional[TokenBucket]:
+    """Cubo por minuto a partir de una variable de entorno; None si no está definida o es 0."""
+    try:
+        per_minute = float(value) if value else 0.0
+    except ValueError:
+        return None
+    return TokenBucket.per_minute(per_minute) if per_minute > 0 else None
+
+
+_SHARED: Dict[tuple, Optional[TokenBucket]] = {}
+_SHARED_LOCK = threading.Lock()
+
+
+def shared_bucket_from_env(key: tuple, value: Optional[str]) -> Optional[TokenBucket]:
+    """Como bucket_from_env, pero un solo cubo por proceso para cada clave.
+
+    La cuota es de la cuenta (endpoint + API key), no de cada instancia del proveedor: todas las
+    instancias que comparten clave descuentan del mismo cubo y comparten las penalizaciones por 429.
+    """
+    with _SHARED_LOCK:
+        full_key = key + (value,)
+        if full_key not in _SHARED:
+            _SHARED[full_key] = bucket_from_env(value)
+        return _SHARED[full_key]
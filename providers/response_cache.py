@@ -0,0 +1,138 @@
+"""
+Caché persistente (SQLite) de respuestas de LLM para llamadas idénticas.
+
+Se activa con CACHE_ENABLE=1. La clave es el sha256 de proveedor, modelo, mensajes y
+parámetros de la llamada; al superar CACHE_MAX_ENTRIES se eliminan las entradas
+usadas hace más tiempo (LRU). Con CACHE_TTL (segundos, 0 = sin vencimiento) las
+respuestas más antiguas que el TTL se ignoran y se vuelven a pedir.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+CACHE_PATH = "data/llm_cache.sqlite"
+
+
+class ResponseCache:
+    """Almacén clave -> texto de respuesta con desalojo LRU."""
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = 10000, ttl: float = 0):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Una conexión compartida: achat por defecto ejecuta chat() en hilos
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, last_access REAL NOT NULL, "
+                "created REAL NOT NULL DEFAULT 0)"
+            )
+            # Cachés creadas antes de existir el TTL: sus filas quedan con created = 0
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(responses)")}
+            if "created" not in columns:
+                self._conn.execute("ALTER TABLE responses ADD COLUMN created REAL NOT NULL DEFAULT 0")
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if self.ttl and row[1] < now - self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, last_access, created) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._conn.commit()
+
+
+def make_key(provider_name: str, model: str, messages: List[Dict[str, str]], **kwargs) -> str:
+    payload = json.dumps(
+        {"provider": provider_name, "model": model, "messages": messages, "params": kwargs},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+_CACHE: Optional[ResponseCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Retorna la caché compartida del proceso, o None si CACHE_ENABLE no está activo."""
+    global _CACHE
+    if os.getenv("CACHE_ENABLE", "0") != "1":
+        return None
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = ResponseCache(
+                path=os.getenv("CACHE_PATH", CACHE_PATH),
+                max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "10000")),
+                ttl=float(os.getenv("CACHE_TTL", "0")),
+            )
+    return _CACHE
+
+
+def cached_chat(func):
+    """Decorador para chat/achat de un proveedor: reutiliza la respuesta de una llamada idéntica.
+
+    Con el proveedor en modo degradado (is_available False, p. ej. sin API key) no se lee ni se
+    guarda nada: el texto de relleno no debe seguir sirviéndose una vez configurada la clave.
+    """
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(self, messages, **kwargs):
+            cache = get_response_cache()
+            if cache is None or not self.is_available:
+                return await func(self, messages, **kwargs)
+            key = make_key(self.name, getattr(self, "model", ""), messages, **kwargs)
+            hit = cache.get(key)
+            if hit is not None:
+                return hit
+            response = await func(self, messages, **kwargs)
+            cache.put(key, response)
+            return response
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, messages, **kwargs):
+        cache = get_response_cache()
+        if cache is None or not self.is_available:
+            return func(self, messages, **kwargs)
+        key = make_key(self.name, getattr(self, "model", ""), messages, **kwargs)
+        hit = cache.get(key)
+        if hit is not None:
+            return hit
+        response = func(self, messages, **kwargs)
+        cache.put(key, response)
+        return response
+    return wrapper
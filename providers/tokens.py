@@ -0,0 +1,28 @@
+"""
+Conteo de tokens para estimación de costos.
+
+Usa tiktoken (cl100k_base); la codificación se carga en el primer conteo, no al importar.
+Los conteos por texto se memorizan: el system prompt y los contextos repetidos se tokenizan una vez.
+"""
+
+from functools import lru_cache
+from typing import Dict, List
+
+import tiktoken
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> tiktoken.Encoding:
+    return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    # encode_ordinary: mismo resultado que encode(disallowed_special=()) sin buscar tokens especiales
+    return max(1, len(_encoding().encode_ordinary(text)))
+
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """Tokens de una conversación: se cuenta el contenido de cada mensaje (sin serializar la lista)."""
+    # Overhead documentado por OpenAI: ~4 tokens por mensaje (rol y separadores)
+    return sum(count_tokens(m.get("content", "")) for m in messages) + 4 * len(messages)
@@ -4,21 +4,44 @@ Sistema de Recuperación Aumentada por Generación (RAG)
 para el asistente de la Universidad de La Frontera.
 """
 
-from .retrieve import Retriever
-from .embedding_system import EmbeddingSystem
-from .prompts import SYSTEM_PROMPT, build_user_prompt
-from .data_models import DocumentChunk
+import importlib
+
+# Carga diferida (PEP 562): python -m rag.ingest / rag.embed no arrastran faiss, torch ni
+# sentence-transformers hasta que se usa el nombre que los necesita
+_EXPORTS = {
+    'Retriever': '.retrieve',
+    'Reranker': '.reranker',
+    'EmbeddingSystem': '.embedding_system',
+    'SYSTEM_PROMPT': '.prompts',
+    'build_user_prompt': '.prompts',
+    'DocumentChunk': '.data_models',
+}
 
 # Importaciones opcionales (no necesarias para construir índices, p. ej. python -m rag.embed)
-try:
-    from .rag_engine import RAGEngine, RAGResponse, ask_rag_question 
-except Exception:
-    RAGEngine = None 
-    RAGResponse = None  
-    ask_rag_question = None  
+_OPTIONAL_EXPORTS = {
+    'RAGEngine': '.rag_engine',
+    'RAGResponse': '.rag_engine',
+    'ask_rag_question': '.rag_engine',
+}
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    elif name in _OPTIONAL_EXPORTS:
+        try:
+            value = getattr(importlib.import_module(_OPTIONAL_EXPORTS[name], __name__), name)
+        except Exception:
+            value = None
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
 
 __all__ = [
     'Retriever', 
+    'Reranker',
     'EmbeddingSystem', 
     'SYSTEM_PROMPT', 
     'build_user_prompt',
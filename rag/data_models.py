@@ -1,14 +1,26 @@
 import os
-import hashlib
 from dataclasses import dataclass
 from typing import Optional, Dict, Any
 
+import xxhash
 
-@dataclass
+
+def make_chunk_id(doc_id: str, page: int, content: str) -> str:
+    """Id determinístico del chunk: xxh3_64 (16 hex) de doc_id|page|content.
+
+    No se necesita resistencia criptográfica y xxh3 es mucho más rápido que md5. xxhash es
+    dependencia obligatoria para que el mismo chunk tenga el mismo id en todos los entornos.
+    """
+    data = (str(doc_id) + '|' + str(page) + '|' + (content or '')).encode('utf-8')
+    return f"chunk-{xxhash.xxh3_64_hexdigest(data)}"
+
+
+@dataclass(slots=True)
 class DocumentChunk:
     """
     Representa un fragmento de texto de un documento para el sistema RAG.
     Versión unificada que combina funcionalidad de DocumentChunk y ChunkRecord.
+    Usa __slots__ (sin __dict__ por instancia): hay un objeto por chunk del corpus en memoria.
     """
     # Contenido principal
     content: str                 
@@ -27,6 +39,11 @@ class DocumentChunk:
     # Metadatos técnicos
     chunk_size: int = 0       
     overlap: int = 0          
+
+    # Relevancia asignada por el retriever (similitud de FAISS; None si no viene de una búsqueda)
+    score: Optional[float] = None
+    # Puntaje del cross-encoder cuando la búsqueda usó rerank (logit, no comparable con score)
+    rerank_score: Optional[float] = None
     
     def __post_init__(self):
         """Normaliza y completa metadatos cuando faltan (pensado para PDFs en directorios)."""
@@ -51,9 +68,7 @@ class DocumentChunk:
 
         # chunk_id determinístico si falta
         if not self.chunk_id:
-            h = hashlib.md5()
-            h.update((str(self.doc_id) + '|' + str(self.page) + '|' + (self.content or '')).encode('utf-8'))
-            self.chunk_id = f"chunk-{h.hexdigest()[:16]}"
+            self.chunk_id = make_chunk_id(self.doc_id, self.page, self.content)
 
     def to_dict(self) -> Dict[str, Any]:
         """Convierte el chunk a diccionario para serialización."""
@@ -119,9 +134,7 @@ class DocumentChunk:
         source = os.path.basename(file_path).strip()
         did = doc_id or source
         if not chunk_id:
-            h = hashlib.md5()
-            h.update((str(did) + '|' + str(page) + '|' + (content or '')).encode('utf-8'))
-            chunk_id = f"chunk-{h.hexdigest()[:16]}"
+            chunk_id = make_chunk_id(did, page, content)
         ttl = title or (source[:-4] if source.lower().endswith('.pdf') else source)
         ttl = ttl.replace('_', ' ').replace('-', ' ').strip().capitalize()
         return cls(
@@ -10,36 +10,46 @@ PROCESSED_FILE = "data/processed/chunks.parquet"
 INDEX_FILE = "data/index.faiss"
 CHUNKS_WITH_EMBEDDINGS = "data/processed/chunks_with_embeddings.parquet"
 
+def _first_column(df: pd.DataFrame, names, default):
+    """Primera columna existente entre `names`; si no hay ninguna, `default`."""
+    for name in names:
+        if name in df.columns:
+            return df[name]
+    return default
+
+
 def load_chunks_from_parquet(file_path: str):
     """Carga chunks desde archivo parquet y los convierte a DocumentChunk."""
     df = pd.read_parquet(file_path)
-    chunks = []
-    
-    # Detectar columnas disponibles y mapear
-    cols = set(df.columns)
-    for i, row in df.iterrows():
-        # Soportar esquemas: (doc,text,chunk_id) o (doc_id,content,chunk_id,page,...)
-        doc_id = row.get('doc_id', row.get('doc', f'doc_{i}'))
-        title = row.get('title', row.get('doc', str(doc_id)))
-        content = row.get('content', row.get('text', ''))
-        page = int(row.get('page', 1))
-        chunk_id = str(row.get('chunk_id', i))
-        url = row.get('url', '')
-        vigencia = row.get('vigencia', '')
+    row_ids = pd.Series(df.index, index=df.index)
 
-        chunk = DocumentChunk(
+    # Soportar esquemas: (doc,text,chunk_id) o (doc_id,content,chunk_id,page,...).
+    # Columnas completas en lugar de iterrows: se convierten a listas una sola vez
+    doc_ids = _first_column(df, ('doc_id', 'doc'), 'doc_' + row_ids.astype(str)).astype(str)
+    titles = _first_column(df, ('title', 'doc'), doc_ids).astype(str)
+    contents = _first_column(df, ('content', 'text'), pd.Series('', index=df.index))
+    pages = _first_column(df, ('page',), pd.Series(1, index=df.index)).astype(int)
+    chunk_ids = _first_column(df, ('chunk_id',), row_ids).astype(str)
+    urls = _first_column(df, ('url',), pd.Series('', index=df.index)).fillna('').astype(str)
+    vigencias = _first_column(df, ('vigencia',), pd.Series('', index=df.index)).fillna('').astype(str)
+
+    # chunk_id siempre viene dado: __post_init__ no recalcula hashes
+    return [
+        DocumentChunk(
             content=content,
-            source=str(doc_id),
+            source=doc_id,
             page=page,
             chunk_id=chunk_id,
-            doc_id=str(doc_id),
-            title=str(title),
-            url=str(url) if pd.notna(url) else "",
-            vigencia=str(vigencia) if pd.notna(vigencia) else "",
+            doc_id=doc_id,
+            title=title,
+            url=url,
+            vigencia=vigencia,
+        )
+        for content, doc_id, page, chunk_id, title, url, vigencia in zip(
+            contents.tolist(), doc_ids.tolist(), pages.tolist(), chunk_ids.tolist(),
+            titles.tolist(), urls.tolist(), vigencias.tolist(),
         )
-        chunks.append(chunk)
-    
-    return chunks
+    ]
 
 def build_index():
     """Construye índice FAISS usando EmbeddingSystem."""
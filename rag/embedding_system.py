@@ -1,25 +1,159 @@
 from sentence_transformers import SentenceTransformer
 import numpy as np
+import torch
 import faiss
-import pandas as pd
-from typing import List
+import json
+import math
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+import threading
+from functools import lru_cache
+from typing import Dict, List
 from .data_models import DocumentChunk
 
+# Modelos ya cargados en el proceso: cada Retriever/EmbeddingSystem reutiliza el mismo
+_MODELS: Dict[str, SentenceTransformer] = {}
+_MODELS_LOCK = threading.Lock()
+
+
+def _get_model(model_name: str) -> SentenceTransformer:
+    # El lock evita cargar dos veces si un hilo de precalentamiento y una consulta coinciden
+    with _MODELS_LOCK:
+        if model_name not in _MODELS:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            model = SentenceTransformer(model_name, device=device)
+            if device == "cuda":
+                # FP16 en GPU: mitad de memoria y ancho de banda, diferencia despreciable en similitud
+                model.half()
+            elif os.getenv("EMBED_INT8") == "1":
+                # INT8 dinámico en CPU: pesos de las capas lineales en int8, activaciones cuantizadas al vuelo
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            _MODELS[model_name] = model
+        return _MODELS[model_name]
+
+
+@lru_cache(maxsize=4096)
+def _encode_query(model_name: str, text: str) -> np.ndarray:
+    # Consultas repetidas (/compare, reintentos, gold set) no vuelven a pasar por el modelo
+    vec = np.array(_get_model(model_name).encode([text]), dtype="float32")
+    vec.setflags(write=False)
+    return vec
+
+
+def query_cache_info():
+    """Estadísticas (hits, misses, currsize) de la caché de embeddings de consultas."""
+    return _encode_query.cache_info()
+
+
+def embeddings_path_for(chunks_path: str) -> str:
+    """Ruta del .npy de embeddings que acompaña a un parquet de chunks (misma fila = mismo chunk)."""
+    root, _ = os.path.splitext(chunks_path)
+    return root + ".emb.npy"
+
+
+# Desde este número de textos embed_texts reparte la codificación entre procesos
+EMBED_MP_MIN_TEXTS = 2000
+
+# Desde este número de vectores el índice plano (O(N·d) por consulta) se reemplaza por IVF-PQ
+IVFPQ_MIN_VECTORS = int(os.getenv("IVFPQ_MIN_VECTORS", "20000"))
+
+# Tipo de índice: auto (plano o IVF-PQ según tamaño), flat, ivfpq o hnsw
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "auto").strip().lower()
+HNSW_M = 32
+# Con FAISS_INDEX_TYPE=auto, un índice plano con más vectores que esto lleva además un grafo HNSW
+HNSW_MIN_VECTORS = 10_000
+HNSW_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+
+
+def _choose_pq_m(d: int, max_m: int = 32) -> int:
+    # Número de subcuantizadores: el mayor divisor de d que no supere max_m
+    return next(m for m in range(min(max_m, d), 0, -1) if d % m == 0)
+
+
+def build_hnsw_index(embs: np.ndarray):
+    """Grafo HNSW sobre los vectores completos: cada consulta visita ~log(N) nodos en lugar de todos."""
+    n, d = embs.shape
+    index = faiss.IndexHNSWFlat(d, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = 80
+    index.add(embs)
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    return index, {"index_type": "IndexHNSWFlat", "n": n, "d": d, "M": HNSW_M, "efSearch": HNSW_EF_SEARCH}
+
+
+def _build_faiss_index(embs: np.ndarray):
+    """Índice plano para corpus chicos; IVF-PQ (búsqueda en nprobe listas, códigos de 8 bits) para grandes.
+
+    FAISS_INDEX_TYPE fuerza el tipo (flat, ivfpq o hnsw).
+    """
+    n, d = embs.shape
+    if FAISS_INDEX_TYPE == "hnsw":
+        return build_hnsw_index(embs)
+    # PQ de 8 bits necesita al menos 256 vectores para entrenar sus centroides
+    if FAISS_INDEX_TYPE == "flat" or n < 256 or (FAISS_INDEX_TYPE != "ivfpq" and n < IVFPQ_MIN_VECTORS):
+        index = faiss.IndexFlatIP(d)
+        index.add(embs)
+        return index, {"index_type": "IndexFlatIP", "n": n, "d": d}
+
+    # ~4*sqrt(N) listas, con al menos 39 vectores de entrenamiento por lista (recomendación FAISS)
+    nlist = max(1, min(int(4 * math.sqrt(n)), n // 39))
+    m = _choose_pq_m(d)
+    quantizer = faiss.IndexFlatIP(d)
+    index = faiss.IndexIVFPQ(quantizer, d, nlist, m, 8, faiss.METRIC_INNER_PRODUCT)
+    index.train(embs)
+    index.add(embs)
+    # nprobe se serializa con el índice; FAISS_NPROBE permite ajustarlo al cargar
+    index.nprobe = min(nlist, max(8, nlist // 16))
+    return index, {"index_type": "IndexIVFPQ", "n": n, "d": d, "nlist": nlist, "m": m, "nbits": 8,
+                   "nprobe": index.nprobe}
+
+
 class EmbeddingSystem:
     """Generador de embeddings vectoriales"""
 
     def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
+        self.model_name = model_name
+        self.model = _get_model(model_name)
 
     def embed_text(self, text: str):
-        """Convierte un texto en vector numpy"""
-        vec = self.model.encode([text])
-        return np.array(vec, dtype="float32")
+        """Convierte un texto en vector numpy (memoizado por modelo y texto)"""
+        # Copia: algunos llamadores normalizan el vector in-place
+        return _encode_query(self.model_name, text).copy()
 
-    def embed_texts(self, texts: List[str]) -> np.ndarray:
-        """Embebe una lista de textos a matriz numpy (n, d)."""
-        vecs = self.model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
-        return vecs.astype("float32")
+    def embed_queries(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        """Embebe varias consultas en lotes; mismo formato que embed_text (sin normalizar), una fila por texto."""
+        vecs = self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        return np.asarray(vecs, dtype="float32")
+
+    def embed_texts(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        """Embebe una lista de textos a matriz numpy (n, d).
+
+        encode ordena internamente los textos por longitud antes de armar los lotes (y restaura el
+        orden al final), así que cada lote se rellena casi solo hasta su propio largo.
+        Corpus grandes en CPU (o varias GPU) se reparten entre procesos (EMBED_MP=0 lo desactiva).
+        """
+        if len(texts) > EMBED_MP_MIN_TEXTS and os.getenv("EMBED_MP", "1") == "1" and torch.cuda.device_count() != 1:
+            try:
+                pool = self.model.start_multi_process_pool()
+            except Exception as e:
+                print(f"[embed] Sin pool multiproceso ({e}); se codifica en un solo proceso")
+            else:
+                try:
+                    vecs = self.model.encode_multi_process(
+                        texts, pool, batch_size=batch_size, normalize_embeddings=True
+                    )
+                finally:
+                    self.model.stop_multi_process_pool(pool)
+                return np.asarray(vecs, dtype="float32")
+
+        vecs = self.model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+        return vecs.astype("float32", copy=False)
 
     def build_and_save_index(self, chunks: List[DocumentChunk], index_path: str, chunks_path: str):
         """Construye un índice FAISS y guarda los chunks con embeddings."""
@@ -29,25 +163,48 @@ class EmbeddingSystem:
         texts = [c.content for c in chunks]
         embs = self.embed_texts(texts)
 
-        d = embs.shape[1]
-        index = faiss.IndexFlatIP(d)
-        # Aseguramos que los embeddings estén normalizados para IP ~ coseno
+        # Aseguramos que los embeddings estén normalizados para IP ~ coseno (antes de entrenar)
         faiss.normalize_L2(embs)
-        index.add(embs)
+        index, meta = _build_faiss_index(embs)
 
         faiss.write_index(index, index_path)
+        # Sidecar con el tipo de índice y sus parámetros (para diagnóstico y herramientas)
+        with open(index_path + ".json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+        # Grafo HNSW junto al índice plano (el Retriever lo prefiere al cargar); se escribe a un
+        # temporal y se renombra para que ningún proceso lea un archivo a medio escribir
+        hnsw_path = index_path + ".hnsw"
+        if FAISS_INDEX_TYPE == "auto" and isinstance(index, faiss.IndexFlat) and index.ntotal > HNSW_MIN_VECTORS:
+            hnsw, _ = build_hnsw_index(embs)
+            faiss.write_index(hnsw, hnsw_path + ".tmp")
+            os.replace(hnsw_path + ".tmp", hnsw_path)
+        elif os.path.exists(hnsw_path):
+            os.remove(hnsw_path)
+
+        # Guardar chunks con embeddings en parquet: una lista por columna (sin dict por chunk)
+        # y una tabla Arrow a partir de ellas, escrita por row groups (sin DataFrame intermedio)
+        n = len(chunks)
+        doc_ids, titles, pages, chunk_ids, urls, vigencias = ([None] * n for _ in range(6))
+        for i, c in enumerate(chunks):
+            doc_ids[i] = c.doc_id
+            titles[i] = c.title
+            pages[i] = c.page
+            chunk_ids[i] = c.chunk_id
+            urls[i] = c.url
+            vigencias[i] = c.vigencia
+        table = pa.table({
+            'doc_id': doc_ids,
+            'title': titles,
+            'content': texts,
+            'page': pa.array(pages, type=pa.int32()),
+            'chunk_id': chunk_ids,
+            'url': urls,
+            'vigencia': vigencias,
+        })
+        # A un temporal y luego os.replace: un lector concurrente (web.py) no ve un parquet a medio escribir
+        pq.write_table(table, chunks_path + ".tmp", row_group_size=10_000, compression="zstd", compression_level=3)
+        os.replace(chunks_path + ".tmp", chunks_path)
 
-        # Guardar chunks con embeddings en parquet
-        data = []
-        for c in chunks:
-            data.append({
-                'doc_id': c.doc_id,
-                'title': c.title,
-                'content': c.content,
-                'page': c.page,
-                'chunk_id': c.chunk_id,
-                'url': c.url,
-                'vigencia': c.vigencia
-            })
-        df = pd.DataFrame(data)
-        df.to_parquet(chunks_path, index=False)
+        # Matriz de embeddings contigua en FP16 junto al parquet: se abre con mmap sin re-codificar
+        np.save(embeddings_path_for(chunks_path), embs.astype(np.float16))
@@ -1,99 +1,153 @@
 """
 Ingesta mínima de documentos:
 - Recorre data/raw/
-- Extrae texto de PDFs y TXT
+- Extrae texto de PDFs (en paralelo, un proceso por núcleo) y TXT
 - Genera chunks simples por página (PDF) o documento (TXT)
 - Guarda data/processed/chunks.parquet
 
-Requisitos: pypdf, pandas, pyarrow
+Requisitos: pypdf, pandas, pyarrow (PyMuPDF opcional, extracción más rápida)
 """
 
 from __future__ import annotations
 
 import os
-import hashlib
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import List, Dict
 
-import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pypdf import PdfReader
 
+try:
+    import fitz  # PyMuPDF (opcional)
+except ImportError:
+    fitz = None
+
+from rag.data_models import make_chunk_id
+
 
 RAW_DIR = Path("data/raw")
 PROCESSED_DIR = Path("data/processed")
 CHUNKS_PATH = PROCESSED_DIR / "chunks.parquet"
 
+CHUNKS_SCHEMA = pa.schema([
+    ('doc_id', pa.string()),
+    ('title', pa.string()),
+    ('content', pa.string()),
+    ('page', pa.int64()),
+    ('chunk_id', pa.string()),
+    ('url', pa.string()),
+    ('vigencia', pa.string()),
+])
+# Registros por row group al escribir chunks.parquet
+ROW_GROUP_SIZE = 10_000
+
 
 def _slug_title(filename: str) -> str:
     name = os.path.splitext(os.path.basename(filename))[0]
     return name.replace('_', ' ').replace('-', ' ').strip().capitalize()
 
 
-def _make_chunk_id(doc_id: str, page: int, content: str) -> str:
-    h = hashlib.md5()
-    h.update((str(doc_id) + '|' + str(page) + '|' + (content or '')).encode('utf-8'))
-    return f"chunk-{h.hexdigest()[:16]}"
+def _record(doc_id: str, title: str, text: str, page: int) -> Dict:
+    return {
+        'doc_id': doc_id,
+        'title': title,
+        'content': text,
+        'page': page,
+        'chunk_id': make_chunk_id(doc_id, page, text),
+        'url': '',
+        'vigencia': ''
+    }
+
+
+def _pdf_page_texts(path: Path) -> List[str]:
+    """Texto por página; usa PyMuPDF (extractor en C) si está instalado, si no pypdf."""
+    if fitz is not None:
+        with fitz.open(str(path)) as doc:
+            return [page.get_text() for page in doc]
+    reader = PdfReader(str(path))
+    # pypdf extract_text puede retornar None si la página es solo imagen
+    return [page.extract_text() or "" for page in reader.pages]
+
+
+def _process_pdf(path: Path) -> List[Dict]:
+    """Un registro por página con texto. Corre en un proceso del pool: los errores se reportan aquí."""
+    doc_id = path.name
+    title = _slug_title(path.name)
+    try:
+        records = []
+        for i, text in enumerate(_pdf_page_texts(path), start=1):
+            text = text.strip()
+            if text:
+                records.append(_record(doc_id, title, text, i))
+        return records
+    except Exception as e:
+        print(f"[ingest] Error procesando {path.name}: {e}")
+        return []
+
+
+def _process_text(path: Path) -> List[Dict]:
+    try:
+        text = path.read_text(encoding='utf-8', errors='ignore').strip()
+    except Exception as e:
+        print(f"[ingest] Error procesando {path.name}: {e}")
+        return []
+    return [_record(path.name, _slug_title(path.name), text, 1)] if text else []
+
+
+# Los row groups se escriben aquí y el archivo se renombra a CHUNKS_PATH al cerrar el writer:
+# un lector concurrente o una caída a mitad de camino nunca ven un parquet truncado
+CHUNKS_TMP_PATH = CHUNKS_PATH.with_name(CHUNKS_PATH.name + ".tmp")
+
+
+def _write_row_group(writer, records: List[Dict]):
+    """Escribe `records` como un row group; abre el ParquetWriter (sobre CHUNKS_TMP_PATH) con el primero."""
+    if writer is None:
+        writer = pq.ParquetWriter(str(CHUNKS_TMP_PATH), CHUNKS_SCHEMA, compression="zstd", compression_level=3)
+    writer.write_table(pa.Table.from_pylist(records, schema=CHUNKS_SCHEMA))
+    return writer
 
 
 def ingest() -> Path:
     RAW_DIR.mkdir(parents=True, exist_ok=True)
     PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
 
-    records: List[Dict] = []
-
-    for path in sorted(RAW_DIR.glob('*')):
-        if not path.is_file():
-            continue
-
-        ext = path.suffix.lower()
-        doc_id = path.name
-        title = _slug_title(path.name)
-
-        try:
-            if ext == ".pdf":
-                reader = PdfReader(str(path))
-                for i, page in enumerate(reader.pages, start=1):
-                    # pypdf extract_text puede retornar None si la página es solo imagen
-                    text = page.extract_text() or ""
-                    text = text.strip()
-                    if not text:
-                        continue
-                    records.append({
-                        'doc_id': doc_id,
-                        'title': title,
-                        'content': text,
-                        'page': i,
-                        'chunk_id': _make_chunk_id(doc_id, i, text),
-                        'url': '',
-                        'vigencia': ''
-                    })
-
-            elif ext in (".txt", ".md"):
-                text = path.read_text(encoding='utf-8', errors='ignore').strip()
-                if text:
-                    records.append({
-                        'doc_id': doc_id,
-                        'title': title,
-                        'content': text,
-                        'page': 1,
-                        'chunk_id': _make_chunk_id(doc_id, 1, text),
-                        'url': '',
-                        'vigencia': ''
-                    })
-            else:
-                # Ignorar otros tipos de archivo
-                continue
-
-        except Exception as e:
-            print(f"[ingest] Error procesando {path.name}: {e}")
-            continue
-
-    if not records:
+    # Ignorar otros tipos de archivo
+    paths = [p for p in sorted(RAW_DIR.glob('*')) if p.is_file() and p.suffix.lower() in (".pdf", ".txt", ".md")]
+    pdfs = [p for p in paths if p.suffix.lower() == ".pdf"]
+
+    # La extracción de PDFs es CPU y cada archivo es independiente: un proceso por núcleo.
+    # Los registros se escriben por row groups a medida que llegan (no se acumula todo el corpus)
+    written = 0
+    buffer: List[Dict] = []
+    writer = None
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, min(len(pdfs), os.cpu_count() or 1))) as ex:
+            # map entrega en orden: mismo orden que antes (archivos por nombre, páginas en orden)
+            pdf_results = ex.map(_process_pdf, pdfs)
+            for path in paths:
+                buffer.extend(next(pdf_results) if path.suffix.lower() == ".pdf" else _process_text(path))
+                if len(buffer) >= ROW_GROUP_SIZE:
+                    writer = _write_row_group(writer, buffer)
+                    written += len(buffer)
+                    buffer.clear()
+        if buffer:
+            writer = _write_row_group(writer, buffer)
+            written += len(buffer)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            CHUNKS_TMP_PATH.unlink(missing_ok=True)
+        raise
+    if writer is not None:
+        writer.close()
+        os.replace(CHUNKS_TMP_PATH, CHUNKS_PATH)
+
+    if not written:
         print("[ingest] No se encontraron textos extraíbles en data/raw/")
     else:
-        df = pd.DataFrame(records)
-        df.to_parquet(CHUNKS_PATH, index=False)
-        print(f"[ingest] Guardado {len(df)} chunks en {CHUNKS_PATH}")
+        print(f"[ingest] Guardado {written} chunks en {CHUNKS_PATH}")
 
     return CHUNKS_PATH
 
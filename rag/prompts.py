@@ -1,3 +1,6 @@
+import re
+from functools import lru_cache
+
 SYSTEM_PROMPT = """Eres un asistente especializado en normativa y reglamentos de la Universidad de La Frontera (UFRO).
 
 INSTRUCCIONES ESPECÍFICAS:
@@ -58,34 +61,52 @@ SPECIALIZED_PROMPTS = {
 - Documentación necesaria"""
 }
 
+# Palabras clave para cada tipo (en orden de prioridad)
+QUERY_KEYWORDS = {
+    "matricula": ["matricula", "matrícula", "inscripcion", "inscripción", "admision", "admisión", "postular", "ingreso"],
+    "notas": ["nota", "notas", "calificacion", "calificación", "promedio", "examen", "evaluacion", "evaluación", "reprobar", "aprobar"],
+    "financiero": ["arancel", "pago", "beca", "beneficio", "financiero", "dinero", "costo", "precio", "descuento"],
+    "titulo": ["titulo", "título", "titulacion", "titulación", "tesis", "memoria", "graduacion", "graduación", "grado"]
+}
+
+# Todas las palabras en un solo autómata: un recorrido de la consulta en lugar de uno por tipo.
+# El lookahead encuentra también coincidencias solapadas (p. ej. "nota" dentro de otra palabra clave)
+_KEYWORD_TYPE = {word: query_type for query_type, words in QUERY_KEYWORDS.items() for word in words}
+_KEYWORD_RE = re.compile("(?=(" + "|".join(map(re.escape, _KEYWORD_TYPE)) + "))")
+
 def detect_query_type(query: str) -> str:
     """Detecta el tipo de consulta para usar el prompt especializado"""
-    query_lower = query.lower()
-    
-    # Palabras clave para cada tipo
-    keywords = {
-        "matricula": ["matricula", "matrícula", "inscripcion", "inscripción", "admision", "admisión", "postular", "ingreso"],
-        "notas": ["nota", "notas", "calificacion", "calificación", "promedio", "examen", "evaluacion", "evaluación", "reprobar", "aprobar"],
-        "financiero": ["arancel", "pago", "beca", "beneficio", "financiero", "dinero", "costo", "precio", "descuento"],
-        "titulo": ["titulo", "título", "titulacion", "titulación", "tesis", "memoria", "graduacion", "graduación", "grado"]
-    }
-    
-    for query_type, words in keywords.items():
-        if any(word in query_lower for word in words):
-            return query_type
-    
-    return "general"
+    found = {_KEYWORD_TYPE[word] for word in _KEYWORD_RE.findall(query.lower())}
+    # Si hay palabras de varios tipos gana el primero en QUERY_KEYWORDS, como antes
+    return next((query_type for query_type in QUERY_KEYWORDS if query_type in found), "general")
+
+# Prompts del sistema ya armados por tipo: get_system_prompt es solo una búsqueda en el dict
+_SYSTEM_BY_TYPE = {
+    "general": SYSTEM_PROMPT,
+    **{qt: SYSTEM_PROMPT + "\n\nENFOQUE ESPECIALIZADO:\n" + p for qt, p in SPECIALIZED_PROMPTS.items()},
+}
 
 def get_system_prompt(query_type: str = "general") -> str:
     """Obtiene el prompt del sistema según el tipo de consulta"""
-    if query_type in SPECIALIZED_PROMPTS:
-        return SYSTEM_PROMPT + "\n\nENFOQUE ESPECIALIZADO:\n" + SPECIALIZED_PROMPTS[query_type]
-    return SYSTEM_PROMPT
+    return _SYSTEM_BY_TYPE.get(query_type, SYSTEM_PROMPT)
 
 def build_user_prompt(query: str, docs: list):
     """Construye el prompt del usuario con contexto específico de UFRO"""
-    
-    if not docs:
+    # Normaliza los documentos a una clave hashable para reutilizar prompts ya construidos
+    doc_key = tuple(
+        (
+            d.get('source', d.get('doc_id', d.get('doc', 'Documento desconocido'))),
+            d.get('page', d.get('page_number', d.get('page_num', 'N/A'))),
+            d.get('content', d.get('text', '')),
+            d.get('score', 0.0),
+        )
+        for d in docs
+    )
+    return _build_user_prompt_cached(query, doc_key)
+
+@lru_cache(maxsize=512)
+def _build_user_prompt_cached(query: str, doc_key: tuple) -> str:
+    if not doc_key:
         return f"""Pregunta: {query}
 
 No se encontraron documentos relevantes en la base de datos de normativa UFRO.
@@ -93,13 +114,7 @@ No se encontraron documentos relevantes en la base de datos de normativa UFRO.
 Respuesta: No encontré esta información específica en la normativa disponible."""
     
     context_parts = []
-    for i, d in enumerate(docs, 1):
-        # Extraer información del documento
-        source = d.get('source', d.get('doc_id', d.get('doc', 'Documento desconocido')))
-        page = d.get('page', d.get('page_number', d.get('page_num', 'N/A')))
-        content = d.get('content', d.get('text', ''))
-        score = d.get('score', 0.0)
-        
+    for i, (source, page, content, score) in enumerate(doc_key, 1):
         # Limpiar nombre del documento para referencia
         doc_name = source.replace('.pdf', '').replace('data/raw/', '').replace('/', '')
         
@@ -1,53 +1,163 @@
 from __future__ import annotations
 
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple, TypeVar
 
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from .data_models import DocumentChunk
-from .embedding_system import EmbeddingSystem
-from .vector_store_qdrant import get_qdrant_client, ensure_collection, upsert_chunks
+from .embedding_system import EmbeddingSystem, embeddings_path_for
+from .vector_store_qdrant import CHUNK_STORE_PATH, ChunkStore, get_qdrant_client, ensure_collection, upsert_chunks
 
 
 PROCESSED = Path("data/processed/chunks_with_embeddings.parquet")
 FALLBACK = Path("data/processed/chunks.parquet")
 
+# Solo estas columnas se leen del parquet (el resto de column chunks ni se descomprime)
+QDRANT_COLUMNS = ('content', 'doc_id', 'page', 'chunk_id', 'title', 'url', 'vigencia')
+BATCH_SIZE = 2048
+# Lotes leídos por adelantado mientras se embebe el actual
+PREFETCH_BATCHES = 2
+
+T = TypeVar("T")
+
+
+def _batch_chunks(batch: pa.RecordBatch) -> List[DocumentChunk]:
+    """Convierte un RecordBatch a DocumentChunk, una lista de Python por columna."""
+    names = batch.schema.names
+
+    def column(name, default=""):
+        if name not in names:
+            return [default] * batch.num_rows
+        return [default if v is None else v for v in batch.column(name).to_pylist()]
+
+    return [
+        DocumentChunk(
+            content=content,
+            source=str(doc_id),
+            page=int(page),
+            chunk_id=str(chunk_id),
+            doc_id=str(doc_id),
+            title=str(title),
+            url=str(url),
+            vigencia=str(vigencia),
+        )
+        for content, doc_id, page, chunk_id, title, url, vigencia in zip(
+            column('content'), column('doc_id'), column('page', 0), column('chunk_id'),
+            column('title'), column('url'), column('vigencia'),
+        )
+    ]
+
+
+def iter_chunk_batches(path: Path, batch_size: int = BATCH_SIZE) -> Iterator[List[DocumentChunk]]:
+    """Lee el parquet por lotes de `batch_size` filas: la memoria no depende del tamaño del corpus."""
+    parquet = pq.ParquetFile(path)
+    columns = [c for c in QDRANT_COLUMNS if c in parquet.schema_arrow.names]
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=columns):
+        yield _batch_chunks(batch)
+
+
+def _prefetch(items: Iterable[T], depth: int = PREFETCH_BATCHES) -> Iterator[T]:
+    """Consume `items` en un hilo aparte, hasta `depth` elementos por delante de quien itera."""
+    buffer: queue.Queue = queue.Queue(maxsize=depth)
+
+    def produce():
+        try:
+            for item in items:
+                buffer.put((True, item))
+        except Exception as e:
+            buffer.put((False, e))
+        else:
+            buffer.put((False, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        ok, item = buffer.get()
+        if not ok:
+            if item is not None:
+                raise item
+            return
+        yield item
+
+
+def _mark_last(items: Iterable[T]) -> Iterator[Tuple[T, bool]]:
+    """Entrega (item, es_el_último) mirando un elemento por delante."""
+    it = iter(items)
+    try:
+        prev = next(it)
+    except StopIteration:
+        return
+    for item in it:
+        yield prev, False
+        prev = item
+    yield prev, True
+
+
+def _stored_embeddings(path: Path):
+    """Embeddings FP16 que rag.embed guardó junto al parquet (mmap), si cubren todas sus filas."""
+    emb_path = embeddings_path_for(str(path))
+    if not os.path.exists(emb_path):
+        return None
+    stored = np.load(emb_path, mmap_mode='r')
+    if len(stored) != pq.ParquetFile(path).metadata.num_rows:
+        print(f"[qdrant_upsert] {emb_path} no coincide con el parquet; se recalculan los embeddings")
+        return None
+    return stored
+
 
 def main():
     if PROCESSED.exists():
-        df = pd.read_parquet(PROCESSED)
+        path = PROCESSED
     elif FALLBACK.exists():
-        df = pd.read_parquet(FALLBACK)
+        path = FALLBACK
     else:
         print("[qdrant_upsert] No hay parquet de chunks. Ejecuta 'python -m rag.ingest' primero.")
         return
 
-    chunks = []
-    for _, row in df.iterrows():
-        chunks.append(DocumentChunk(
-            content=row.get('content', ''),
-            source=str(row.get('doc_id', '')),
-            page=int(row.get('page', 0)),
-            chunk_id=str(row.get('chunk_id', '')),
-            doc_id=str(row.get('doc_id', '')),
-            title=str(row.get('title', '')),
-            url=str(row.get('url', '')),
-            vigencia=str(row.get('vigencia', '')),
-        ))
-
-    model_name = os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2")
-    embedder = EmbeddingSystem(model_name=model_name)
-
-    texts = [c.content for c in chunks]
-    embeddings = embedder.embed_texts(texts)
+    # Si rag.embed ya calculó los embeddings se reutilizan y no se carga el modelo
+    stored = _stored_embeddings(path)
+    embedder = None
+    if stored is None:
+        embedder = EmbeddingSystem(model_name=os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2"))
 
     client = get_qdrant_client()
     collection = os.getenv("QDRANT_COLLECTION", "ufro_chunks")
-    ensure_collection(client, collection, vector_size=embeddings.shape[1])
-    upsert_chunks(client, collection, chunks, embeddings)
+    # Opcional: texto y metadatos pesados en SQLite local y en Qdrant solo vector + payload mínimo.
+    # Los lectores necesitan ese archivo, así que por defecto se sube el payload completo
+    store = None
+    if os.getenv("QDRANT_SLIM_PAYLOAD", "0") == "1":
+        store = ChunkStore(os.getenv("QDRANT_CHUNK_STORE", CHUNK_STORE_PATH))
+
+    # Tres etapas solapadas: un hilo lee lotes del parquet, este hilo embebe y otro sube a Qdrant.
+    # Como máximo hay una subida en curso; los ids siguen la posición en el parquet.
+    # Los lotes se envían con wait=False (Qdrant responde al registrar la operación) y solo el
+    # último espera a que se aplique: Qdrant aplica las operaciones en orden, así que al volver
+    # ese último la colección tiene todos los puntos
+    total = 0
+    pending = None
+    with ThreadPoolExecutor(max_workers=1) as uploader:
+        for chunks, last in _mark_last(_prefetch(iter_chunk_batches(path))):
+            if stored is not None:
+                embeddings = np.asarray(stored[total:total + len(chunks)], dtype=np.float32)
+            else:
+                embeddings = embedder.embed_texts([c.content for c in chunks])
+            if total == 0:
+                ensure_collection(client, collection, vector_size=embeddings.shape[1])
+            if pending is not None:
+                pending.result()
+            pending = uploader.submit(upsert_chunks, client, collection, chunks, embeddings,
+                                      start_id=total, store=store, wait=last)
+            total += len(chunks)
+        if pending is not None:
+            pending.result()
 
-    print(f"[qdrant_upsert] Upsert de {len(chunks)} chunks a la colección '{collection}' completado.")
+    print(f"[qdrant_upsert] Upsert de {total} chunks a la colección '{collection}' completado.")
 
 
 if __name__ == "__main__":
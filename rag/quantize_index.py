@@ -0,0 +1,66 @@
+"""
+Cuantización del índice FAISS a SQ8 (int8 por dimensión, 4x menos bytes por vector):
+- Lee data/index.faiss (IndexFlatIP generado por python -m rag.embed)
+- Reconstruye los vectores y entrena SQ8 con producto interno: plano (búsqueda exhaustiva)
+  para corpus chicos, IVF{nlist},SQ8 desde SQ8_IVF_MIN_VECTORS
+- Guarda data/index.faiss.sq8 (app.py, web.py y el Retriever lo prefieren si existe)
+
+Uso: python -m rag.quantize_index
+"""
+
+import math
+import os
+
+import faiss
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INDEX_FILE = "data/index.faiss"
+QUANTIZED_INDEX_FILE = "data/index.faiss.sq8"
+
+# Bajo este tamaño basta recorrer todos los códigos int8; IVF solo agrega pérdida de recall
+SQ8_IVF_MIN_VECTORS = int(os.getenv("SQ8_IVF_MIN_VECTORS", "10000"))
+
+
+def _choose_nlist(n: int) -> int:
+    # ~4*sqrt(N) listas, con al menos 39 vectores de entrenamiento por lista (recomendación FAISS)
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def quantize_index(src: str = INDEX_FILE, dst: str = QUANTIZED_INDEX_FILE) -> str:
+    """Convierte un índice plano a SQ8 (plano o IVF) preservando el orden (ids = posición del chunk)."""
+    flat = faiss.read_index(src)
+    if not isinstance(flat, faiss.IndexFlat):
+        # rag.embed ya genera IVF-PQ para corpus grandes (IVFPQ_MIN_VECTORS)
+        raise ValueError(f"El índice de origen ya está cuantizado ({type(flat).__name__})")
+    n, d = flat.ntotal, flat.d
+    if n == 0:
+        raise ValueError("El índice de origen está vacío")
+
+    xb = flat.reconstruct_n(0, n)
+    if n < SQ8_IVF_MIN_VECTORS:
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        index.train(xb)
+        index.add(xb)
+        faiss.write_index(index, dst)
+        print(f"✅ Índice cuantizado ({n} vectores, SQ8 plano) guardado en {dst}")
+        return dst
+
+    nlist = _choose_nlist(n)
+    index = faiss.index_factory(d, f"IVF{nlist},SQ8", faiss.METRIC_INNER_PRODUCT)
+    index.train(xb)
+    index.add(xb)
+    # nprobe se serializa con el índice; FAISS_NPROBE permite ajustarlo al cargar
+    index.nprobe = min(nlist, max(4, nlist // 50))
+
+    faiss.write_index(index, dst)
+    print(f"✅ Índice cuantizado ({n} vectores, nlist={nlist}, nprobe={index.nprobe}) guardado en {dst}")
+    return dst
+
+
+if __name__ == "__main__":
+    if not os.path.exists(INDEX_FILE):
+        print(f"❌ Error: No se encontró {INDEX_FILE}. Ejecuta 'python -m rag.embed' primero.")
+    else:
+        quantize_index()
@@ -0,0 +1,77 @@
+"""
+Reordenamiento (rerank) de candidatos con un cross-encoder.
+
+FAISS recupera un conjunto amplio de candidatos con el bi-encoder y el cross-encoder
+puntúa cada par (consulta, chunk) en conjunto, lo que mejora la precisión de los k
+primeros a costa de una pasada extra del modelo sobre esos pocos candidatos.
+
+Es opcional: se activa con RERANK_ENABLE=1 (o rerank=True) y se configura con RERANK_MODEL y
+RERANK_TOP_N. El modelo se carga recién en la primera búsqueda que lo usa. Si el
+modelo no se puede cargar (sin red, sin sentence-transformers) se mantiene el orden de FAISS.
+"""
+
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+# Multilingüe (entrenado en mMARCO, incluye español) y liviano para CPU
+DEFAULT_RERANK_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "50"))
+RERANK_BATCH_SIZE = 32
+
+
+def rerank_enabled_from_env() -> bool:
+    return os.getenv("RERANK_ENABLE", "0") == "1"
+
+
+class Reranker:
+    """Cross-encoder cargado al primer uso; puntúa pares (consulta, texto)."""
+
+    def __init__(self, model_name: Optional[str] = None):
+        self.model_name = model_name or os.getenv("RERANK_MODEL", DEFAULT_RERANK_MODEL)
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    device = "cuda" if torch.cuda.is_available() else "cpu"
+                    self._model = CrossEncoder(self.model_name, device=device)
+        return self._model
+
+    def rerank(self, query: str, ids: Sequence[int], texts: Sequence[str],
+               k: int) -> Tuple[List[int], List[float]]:
+        """Retorna los k ids con mayor puntaje del cross-encoder y sus puntajes, de mayor a menor."""
+        if not ids:
+            return [], []
+        scores = np.asarray(
+            self.model.predict([(query, text) for text in texts], batch_size=RERANK_BATCH_SIZE),
+            dtype=np.float32,
+        ).reshape(-1)
+        order = np.argsort(-scores, kind="stable")[:k]
+        return [int(ids[i]) for i in order], [float(scores[i]) for i in order]
+
+
+_RERANKERS: Dict[str, Optional[Reranker]] = {}
+_RERANKERS_LOCK = threading.Lock()
+
+
+def get_reranker(model_name: Optional[str] = None) -> Optional[Reranker]:
+    """Reranker compartido del proceso por modelo, o None si no se pudo cargar (se avisa una vez)."""
+    name = model_name or os.getenv("RERANK_MODEL", DEFAULT_RERANK_MODEL)
+    with _RERANKERS_LOCK:
+        if name not in _RERANKERS:
+            reranker = Reranker(name)
+            try:
+                reranker.model
+            except Exception as e:
+                print(f"[rag] Rerank deshabilitado: no se pudo cargar '{name}' ({e})")
+                reranker = None
+            _RERANKERS[name] = reranker
+        return _RERANKERS[name]
@@ -1,91 +1,375 @@
 import os
+import dataclasses
+import threading
+import time
+from collections import OrderedDict
 import faiss
+import numpy as np
 import pandas as pd
-from typing import List, Optional
-from .embedding_system import EmbeddingSystem
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from .embedding_system import HNSW_EF_SEARCH, EmbeddingSystem
 from .data_models import DocumentChunk
+from .reranker import RERANK_TOP_N, Reranker, get_reranker, rerank_enabled_from_env
+
+
+def _read_index(path: str) -> faiss.Index:
+    """Lee un índice pidiendo mmap de solo lectura; si el formato no lo admite, completo en memoria.
+
+    FAISS solo mapea las listas invertidas de los índices IVF (IVF-PQ, IVF-SQ8): esas páginas se
+    comparten entre los workers de un mismo host vía page cache. Los índices planos y HNSW se leen
+    completos en memoria aunque se pida mmap.
+    """
+    try:
+        index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except Exception:
+        index = faiss.read_index(path)
+    else:
+        if isinstance(index, faiss.IndexIVF):
+            print(f"[rag] Índice FAISS cargado con mmap (listas invertidas): {path}")
+            return index
+    print(f"[rag] Índice FAISS cargado en memoria: {path}")
+    return index
+
+
+def load_faiss_index(path: str = "data/index.faiss") -> faiss.Index:
+    """Carga el índice FAISS (ver _read_index: mmap solo en índices IVF) y aplica los ajustes de búsqueda.
+
+    En índices IVF el SO pagina las listas invertidas bajo demanda, evitando el pico de RAM al arrancar.
+    """
+    # Hilos OpenMP de FAISS: solo si se pide; si no, se respeta OMP_NUM_THREADS / el valor de FAISS
+    threads = os.getenv("FAISS_THREADS")
+    if threads:
+        faiss.omp_set_num_threads(int(threads))
+    index = _read_index(path)
+    nprobe = os.getenv("FAISS_NPROBE")
+    if nprobe and hasattr(index, "nprobe"):
+        index.nprobe = int(nprobe)
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+
+# Columnas que consume el Retriever (se soportan esquemas antiguos con 'doc'/'text');
+# RAG_CHUNK_COLS (separadas por coma) permite cambiar la proyección
+CHUNK_COLUMNS = tuple(
+    c.strip() for c in os.getenv(
+        "RAG_CHUNK_COLS", "doc_id,doc,title,content,text,page,chunk_id,url,vigencia"
+    ).split(",") if c.strip()
+)
+
+
+def _use_jemalloc_pool() -> None:
+    """Usa jemalloc para los buffers Arrow: devuelve memoria al SO tras convertir a pandas.
+
+    Respeta ARROW_DEFAULT_MEMORY_POOL si el usuario lo definió; en builds sin jemalloc (p. ej. Windows)
+    se mantiene el pool por defecto.
+    """
+    if os.getenv("ARROW_DEFAULT_MEMORY_POOL"):
+        return
+    try:
+        pa.set_memory_pool(pa.jemalloc_memory_pool())
+    except NotImplementedError:
+        pass
+
+
+def load_chunks_df(path: str, columns: Optional[Sequence[str]] = CHUNK_COLUMNS) -> pd.DataFrame:
+    """Lee el parquet de chunks con memory_map y pre_buffer, proyectando solo las columnas usadas.
+
+    Columnas pesadas que no se usan en la búsqueda (p. ej. embeddings) no se materializan.
+    Con columns=None se leen todas.
+    """
+    _use_jemalloc_pool()
+    cols = None
+    if columns is not None:
+        available = set(pq.read_schema(path).names)
+        cols = [c for c in columns if c in available]
+    # read_table escanea vía pyarrow.dataset: pre_buffer agrupa lecturas y use_threads paraleliza row groups
+    table = pq.read_table(path, columns=cols, memory_map=True, pre_buffer=True, use_threads=True)
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+INDEX_PATH = "data/index.faiss"
+CHUNKS_PATH = "data/processed/chunks_with_embeddings.parquet"
+
+def preferred_index_path(path: str = INDEX_PATH) -> str:
+    """Ruta del índice a cargar: `<path>.sq8` (python -m rag.quantize_index) o `<path>.hnsw`
+    (python -m rag.embed) si existen y están al día; si no, `path`.
+
+    Aquí solo se elige el archivo: los índices derivados se construyen offline.
+    """
+    for derived in (path + ".sq8", path + ".hnsw"):
+        if os.path.exists(derived) and (not os.path.exists(path)
+                                        or os.path.getmtime(derived) >= os.path.getmtime(path)):
+            return derived
+    return path
+
+
+# Índices y DataFrames ya cargados en el proceso, por ruta
+_LOADED: Dict[str, Any] = {}
+_LOADED_LOCK = threading.Lock()
+
+
+def get_index_and_chunks(index_path: str = INDEX_PATH,
+                         chunks_path: str = CHUNKS_PATH) -> Tuple[Optional[faiss.Index], Optional[pd.DataFrame]]:
+    """Carga el índice y los chunks una sola vez por proceso y los reutiliza en llamadas siguientes.
+
+    Retorna None en lo que no exista en disco (se reintenta en la próxima llamada).
+    """
+    with _LOADED_LOCK:
+        if index_path not in _LOADED and os.path.exists(preferred_index_path(index_path)):
+            _LOADED[index_path] = load_faiss_index(preferred_index_path(index_path))
+        if chunks_path not in _LOADED and os.path.exists(chunks_path):
+            _LOADED[chunks_path] = load_chunks_df(chunks_path)
+        return _LOADED.get(index_path), _LOADED.get(chunks_path)
+
+
+class _ResultCache:
+    """LRU con vencimiento (TTL en segundos) para resultados de búsqueda, seguro entre hilos."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+# Resultados por (consulta normalizada, k); RETRIEVAL_CACHE_SIZE=0 desactiva la caché
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "600"))
+
+
+def normalize_query(query: str) -> str:
+    """Colapsa espacios: variantes de espaciado de una misma consulta comparten embedding y resultados."""
+    return " ".join(query.split())
+
 
 class Retriever:
     """Sistema de búsqueda vectorial usando FAISS"""
 
-    def __init__(self, index_path: str = "data/index.faiss",
-                 chunks_path: str = "data/processed/chunks_with_embeddings.parquet",
+    def __init__(self, index_path: str = INDEX_PATH,
+                 chunks_path: str = CHUNKS_PATH,
                  index: Optional[faiss.Index] = None,
-                 chunks_df: Optional[pd.DataFrame] = None):
+                 chunks_df: Optional[pd.DataFrame] = None,
+                 rerank_top_n: int = RERANK_TOP_N,
+                 rerank_enabled: Optional[bool] = None):
         self.index_path = index_path
         self.chunks_path = chunks_path
         self.embedding_system = EmbeddingSystem()
         self.index = index
         self.chunks: List[DocumentChunk] = []
+        # Con rerank se piden rerank_top_n candidatos a FAISS y el cross-encoder elige los k finales;
+        # rerank_enabled=None toma RERANK_ENABLE
+        if rerank_enabled is None:
+            rerank_enabled = rerank_enabled_from_env()
+        self.rerank_top_n = rerank_top_n
+        self.rerank_enabled = rerank_enabled
+        # El cross-encoder se carga en el primer _rank que lo necesite (no al construir el Retriever)
+        self._reranker: Optional[Reranker] = None
+        # Guarda ids y scores ya ordenados; cada acierto arma resultados nuevos con _collect
+        self._results = _ResultCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL)
 
         self._load_index_and_chunks(chunks_df)
 
+    @classmethod
+    def from_prebuilt(cls, index: faiss.Index, chunks_df: pd.DataFrame,
+                      rerank_enabled: Optional[bool] = None) -> "Retriever":
+        """Retriever sobre un índice y un DataFrame de chunks ya cargados (sin leer disco)."""
+        return cls(index=index, chunks_df=chunks_df, rerank_enabled=rerank_enabled)
+
     def _load_index_and_chunks(self, chunks_df: Optional[pd.DataFrame] = None):
         """Carga el índice FAISS y los chunks procesados, o usa los provistos."""
-        # Índice: usar el provisto o cargar desde disco
+        # Lo que no se provea se toma de la caché del proceso (carga desde disco solo la primera vez)
+        if self.index is None or chunks_df is None:
+            cached_index, cached_df = get_index_and_chunks(self.index_path, self.chunks_path)
+            if self.index is None:
+                self.index = cached_index
+            if chunks_df is None:
+                chunks_df = cached_df
+
         if self.index is None:
-            if os.path.exists(self.index_path):
-                self.index = faiss.read_index(self.index_path)
-            else:
-                raise FileNotFoundError("No se encontró el índice FAISS. Ejecuta 'python -m rag.ingest' y luego 'python -m rag.embed'.")
-
-        # Chunks: usar el DataFrame provisto o cargar desde disco
-        if chunks_df is not None:
-            df = chunks_df
-        else:
-            if os.path.exists(self.chunks_path):
-                df = pd.read_parquet(self.chunks_path)
-            else:
-                raise FileNotFoundError("No se encontraron los chunks procesados. Ejecuta 'python -m rag.ingest' y luego 'python -m rag.embed'.")
-        
-        # Mapear columnas del parquet al modelo DocumentChunk
-        chunks_data = []
-        for _, row in df.iterrows():
-            # Soportar esquemas variados
-            content = row.get('content', row.get('text', ''))
-            doc_id = row.get('doc_id', row.get('doc', ''))
-            page = int(row.get('page', 0))
-            chunk_id = str(row.get('chunk_id', ''))
-            title = row.get('title', str(doc_id))
-            url = row.get('url', '')
-            vigencia = row.get('vigencia', '')
-
-            chunk_data = {
-                'content': content,
-                'source': str(doc_id),
-                'page': page,
-                'chunk_id': chunk_id,
-                'doc_id': str(doc_id),
-                'title': str(title),
-                'url': url if pd.notna(url) else "",
-                'vigencia': vigencia if pd.notna(vigencia) else "",
-            }
-            chunks_data.append(chunk_data)
-        
-        self.chunks = [DocumentChunk(**chunk_data) for chunk_data in chunks_data]
-
-    def embed_query(self, query: str):
-        """Convierte la query en un vector"""
-        return self.embedding_system.embed_text(query)
-
-    def search(self, query: str, k: int = 4) -> List[DocumentChunk]:
-        """Busca los k documentos más relevantes"""
-        query_vec = self.embed_query(query)
-        D, I = self.index.search(query_vec, k)
+            raise FileNotFoundError("No se encontró el índice FAISS. Ejecuta 'python -m rag.ingest' y luego 'python -m rag.embed'.")
+        if chunks_df is None:
+            raise FileNotFoundError("No se encontraron los chunks procesados. Ejecuta 'python -m rag.ingest' y luego 'python -m rag.embed'.")
+        df = chunks_df
+        n = len(df)
+
+        def column(*names, default="", dtype=str):
+            # Primera columna presente (se soportan esquemas variados), con nulos y tipo resueltos
+            # en pandas para toda la columna; luego una sola conversión a lista de Python
+            for name in names:
+                if name in df.columns:
+                    return df[name].fillna(default).astype(dtype).tolist()
+            return [default] * n
+
+        # Extracción por columnas (sin iterrows): una lista por campo y un zip para armar los chunks
+        contents = column('content', 'text')
+        doc_ids = column('doc_id', 'doc')
+        pages = column('page', default=0, dtype='int32')
+        chunk_ids = column('chunk_id')
+        titles = column('title') if 'title' in df.columns else doc_ids
+        urls = column('url')
+        vigencias = column('vigencia')
+
+        self.chunks = [
+            DocumentChunk(content=content, source=doc_id, page=page, chunk_id=chunk_id,
+                          doc_id=doc_id, title=title, url=url, vigencia=vigencia)
+            for content, doc_id, page, chunk_id, title, url, vigencia
+            in zip(contents, doc_ids, pages, chunk_ids, titles, urls, vigencias)
+        ]
+
+    def embed_query(self, query: Union[str, List[str]]) -> np.ndarray:
+        """Convierte la(s) query(s) en una matriz (B, d) float32 contigua, una fila por consulta"""
+        if isinstance(query, str):
+            return self.embedding_system.embed_text(query)
+        return np.ascontiguousarray(self.embedding_system.embed_queries(query), dtype="float32")
+
+    def _collect(self, ids, scores, rerank_scores=None, as_dict: bool = False) -> List[Any]:
+        # Copia con el score de esta búsqueda: los chunks cargados se comparten entre consultas.
+        # Con as_dict se arma directamente el dict de contexto (sin copiar el DocumentChunk).
+        # score es siempre la similitud de FAISS; el puntaje del cross-encoder va en rerank_score
+        if rerank_scores is None:
+            rerank_scores = [None] * len(ids)
         results = []
-        for idx, score in zip(I[0], D[0]):
+        for idx, score, rerank_score in zip(ids, scores, rerank_scores):
             if idx < 0 or idx >= len(self.chunks):
                 continue
             chunk = self.chunks[idx]
-            chunk.score = float(score)
-            results.append(chunk)
+            if as_dict:
+                doc = {'content': chunk.content, 'source': chunk.source,
+                       'page': chunk.page, 'score': float(score)}
+                if rerank_score is not None:
+                    doc['rerank_score'] = rerank_score
+                results.append(doc)
+            else:
+                results.append(dataclasses.replace(chunk, score=float(score), rerank_score=rerank_score))
         return results
 
+    def _get_reranker(self) -> Optional[Reranker]:
+        if self.rerank_enabled and self._reranker is None:
+            self._reranker = get_reranker()
+            if self._reranker is None:
+                # No se pudo cargar (get_reranker ya avisó): se sigue solo con FAISS
+                self.rerank_enabled = False
+        return self._reranker
+
+    def _candidates_k(self, k: int) -> int:
+        return max(k, self.rerank_top_n) if self.rerank_enabled else k
+
+    def _rank(self, query: str, ids, scores, k: int) -> tuple:
+        """Reordena los candidatos de FAISS con el cross-encoder (si está activo) y deja los k primeros.
+
+        Retorna (ids, scores de FAISS, scores del cross-encoder o None).
+        """
+        reranker = self._get_reranker()
+        if reranker is not None:
+            cosine = {int(i): float(s) for i, s in zip(ids, scores) if 0 <= i < len(self.chunks)}
+            if cosine:
+                cand_ids = list(cosine)
+                try:
+                    top_ids, rerank_scores = reranker.rerank(
+                        query, cand_ids, [self.chunks[i].content for i in cand_ids], k)
+                except Exception as e:
+                    print(f"[rag] Error en rerank, se usa el orden de FAISS: {e}")
+                else:
+                    return top_ids, [cosine[i] for i in top_ids], rerank_scores
+        return [int(i) for i in ids[:k]], [float(s) for s in scores[:k]], None
+
+    @staticmethod
+    def _cache_key(query: str, k: int) -> tuple:
+        # La consulta ya viene con normalize_query; se distinguen mayúsculas porque el modelo de
+        # embeddings es configurable y puede no ignorarlas
+        return query, k
+
+    def search(self, query: str, k: int = 4, as_dict: bool = False) -> List[Any]:
+        """Busca los k documentos más relevantes (como dicts de contexto si as_dict)"""
+        query = normalize_query(query)
+        key = self._cache_key(query, k)
+        ranked = self._results.get(key)
+        if ranked is None:
+            query_vec = self.embed_query(query)
+            D, I = self.index.search(query_vec, self._candidates_k(k))
+            ranked = self._rank(query, I[0], D[0], k)
+            self._results.put(key, ranked)
+        return self._collect(*ranked, as_dict=as_dict)
+
+    def search_batch(self, queries: List[str], k: int = 4, as_dict: bool = False) -> List[List[Any]]:
+        """Como search, pero embebe todas las consultas en lotes y hace una sola búsqueda FAISS."""
+        if not queries:
+            return []
+        queries = [normalize_query(q) for q in queries]
+        keys = [self._cache_key(q, k) for q in queries]
+        ranked = [self._results.get(key) for key in keys]
+        # Solo las consultas sin resultado en caché pasan por el modelo y FAISS
+        missing = [row for row, r in enumerate(ranked) if r is None]
+        if missing:
+            query_vecs = self.embed_query([queries[row] for row in missing])
+            D, I = self.index.search(query_vecs, self._candidates_k(k))
+            for pos, row in enumerate(missing):
+                ranked[row] = self._rank(queries[row], I[pos], D[pos], k)
+                self._results.put(keys[row], ranked[row])
+        return [self._collect(*r, as_dict=as_dict) for r in ranked]
+
 
-def retrieve(query: str, index=None, chunks_df: pd.DataFrame | None = None, k: int = 4) -> List[DocumentChunk]:
+# Retrievers ya construidos por (índice, chunks, rerank); se guardan también el índice y el
+# DataFrame para que sus id() no se reutilicen mientras la entrada exista
+_RETRIEVERS: Dict[tuple, Tuple[Retriever, tuple]] = {}
+_RETRIEVERS_LOCK = threading.Lock()
+
+
+def get_retriever(index=None, chunks_df: pd.DataFrame | None = None,
+                  rerank: Optional[bool] = None) -> Retriever:
+    """Retriever compartido del proceso: la lista de chunks se arma una sola vez por índice y DataFrame.
+
+    Sin índice ni DataFrame se usan los cargados por get_index_and_chunks.
+    """
+    if rerank is None:
+        rerank = rerank_enabled_from_env()
+    key = (id(index), id(chunks_df), rerank)
+    with _RETRIEVERS_LOCK:
+        entry = _RETRIEVERS.get(key)
+        if entry is None:
+            entry = (Retriever(index=index, chunks_df=chunks_df, rerank_enabled=rerank), (index, chunks_df))
+            _RETRIEVERS[key] = entry
+    return entry[0]
+
+
+def retrieve(query: str, index=None, chunks_df: pd.DataFrame | None = None, k: int = 4,
+             as_dict: bool = False, rerank: Optional[bool] = None) -> List[Any]:
     """Función de conveniencia para recuperar documentos como lista de chunks.
 
-    Si se provee un índice y un DataFrame de chunks ya cargados, se ignoran las rutas por defecto.
+    Si se provee un índice y un DataFrame de chunks ya cargados, se ignoran las rutas por defecto;
+    si no, se usan los cargados una vez por proceso (get_index_and_chunks). El Retriever se
+    reutiliza entre llamadas (get_retriever).
+    Con as_dict=True retorna dicts de contexto (content, source, page, score y rerank_score si hubo
+    rerank) armados en Retriever._collect, listos para build_user_prompt; rerank=None usa RERANK_ENABLE.
     """
-    retriever = Retriever(index=index, chunks_df=chunks_df)
-    return retriever.search(query, k)
+    return get_retriever(index, chunks_df, rerank).search(query, k, as_dict)
+
+
+def retrieve_batch(queries: List[str], index=None, chunks_df: pd.DataFrame | None = None,
+                   k: int = 4, as_dict: bool = False, rerank: Optional[bool] = None) -> List[List[Any]]:
+    """Recupera chunks para varias consultas a la vez (una lista de resultados por consulta, en orden)."""
+    return get_retriever(index, chunks_df, rerank).search_batch(queries, k, as_dict)
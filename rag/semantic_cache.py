@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import faiss
+import numpy as np
+import pandas as pd
+
+from .embedding_system import EmbeddingSystem
+
+
+SEMANTIC_CACHE_PATH = "data/semantic_cache.parquet"
+
+
+def data_fingerprint(*paths: Optional[str]) -> str:
+    """Huella (ruta, tamaño y mtime) de los archivos del índice; cambia al re-indexar."""
+    parts = []
+    for path in paths:
+        if path and os.path.exists(path):
+            st = os.stat(path)
+            parts.append(f"{path}:{st.st_size}:{st.st_mtime_ns}")
+    return "|".join(parts)
+
+
+class SemanticCache:
+    """Caché de respuestas por similitud semántica de la consulta.
+
+    Guarda los embeddings normalizados de las consultas ya respondidas en un
+    IndexFlatIP; si una nueva consulta supera el umbral de coseno para el mismo
+    proveedor, se reutiliza la respuesta y se evita la llamada remota al LLM.
+
+    Cada entrada guarda la huella de los datos (data_fingerprint) con que se respondió: al cargar
+    se descartan las de otro índice y las más antiguas que `ttl` segundos (0 = sin vencimiento).
+    """
+
+    def __init__(self, embedding_system: Optional[EmbeddingSystem] = None,
+                 threshold: float = 0.95, path: str = SEMANTIC_CACHE_PATH,
+                 ttl: float = 0, fingerprint: str = ""):
+        self.threshold = threshold
+        self.path = path
+        self.ttl = ttl
+        self.fingerprint = fingerprint
+        self._embedding_system = embedding_system
+        self.index: Optional[faiss.Index] = None
+        self.entries: List[Dict[str, Any]] = []
+
+    @property
+    def embedding_system(self) -> EmbeddingSystem:
+        # El modelo se carga solo al primer uso
+        if self._embedding_system is None:
+            self._embedding_system = EmbeddingSystem(model_name=os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2"))
+        return self._embedding_system
+
+    def embed(self, query: str) -> np.ndarray:
+        """Embebe la consulta como matriz (1, d) normalizada para IP ~ coseno."""
+        vec = self.embedding_system.embed_text(query)
+        faiss.normalize_L2(vec)
+        return vec
+
+    def lookup(self, query_vec: np.ndarray, provider_name: str) -> Optional[str]:
+        """Retorna la respuesta cacheada más similar del proveedor si supera el umbral."""
+        if self.index is None or self.index.ntotal == 0:
+            return None
+        D, I = self.index.search(query_vec, min(5, self.index.ntotal))
+        for score, idx in zip(D[0], I[0]):
+            if idx < 0 or score < self.threshold:
+                break
+            entry = self.entries[idx]
+            if entry['provider'] == provider_name and not self._expired(entry['ts']):
+                return entry['answer']
+        return None
+
+    def _expired(self, ts: float) -> bool:
+        return bool(self.ttl) and ts < time.time() - self.ttl
+
+    def add(self, query_vec: np.ndarray, query: str, answer: str, provider_name: str) -> None:
+        if self.index is None:
+            self.index = faiss.IndexFlatIP(query_vec.shape[1])
+        self.index.add(query_vec)
+        self.entries.append({
+            'query': query,
+            'answer': answer,
+            'provider': provider_name,
+            'ts': time.time(),
+            'fingerprint': self.fingerprint,
+            'embedding': query_vec[0].tolist(),
+        })
+
+    def load(self) -> None:
+        """Carga la caché persistida (si existe) sin las entradas vencidas o de otro índice."""
+        if not os.path.exists(self.path):
+            return
+        df = pd.read_parquet(self.path)
+        # Cachés guardadas sin huella no se pueden validar contra el índice actual
+        if 'fingerprint' not in df.columns:
+            return
+        df = df[df['fingerprint'] == self.fingerprint]
+        if self.ttl:
+            df = df[df['ts'] >= time.time() - self.ttl]
+        if df.empty:
+            return
+        vecs = np.array(df['embedding'].tolist(), dtype="float32")
+        self.index = faiss.IndexFlatIP(vecs.shape[1])
+        self.index.add(vecs)
+        self.entries = df.to_dict('records')
+
+    def save(self) -> None:
+        if not self.entries:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        pd.DataFrame(self.entries).to_parquet(self.path, index=False)
@@ -1,12 +1,14 @@
 from __future__ import annotations
 
 import os
-from typing import List, Optional
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence
 
 import numpy as np
 import pandas as pd
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+from qdrant_client.models import Distance, VectorParams
 
 from .data_models import DocumentChunk
 from .embedding_system import EmbeddingSystem
@@ -15,11 +17,65 @@ from .embedding_system import EmbeddingSystem
 def get_qdrant_client() -> QdrantClient:
     url = os.getenv("QDRANT_URL")
     api_key = os.getenv("QDRANT_API_KEY")
+    # gRPC envía los vectores como buffers float32 (sin JSON); QDRANT_GRPC=0 vuelve a HTTP
+    prefer_grpc = os.getenv("QDRANT_GRPC", "1") == "1"
+    grpc_port = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
     if url:
-        return QdrantClient(url=url, api_key=api_key)
+        return QdrantClient(url=url, api_key=api_key, prefer_grpc=prefer_grpc, grpc_port=grpc_port)
     host = os.getenv("QDRANT_HOST", "localhost")
     port = int(os.getenv("QDRANT_PORT", "6333"))
-    return QdrantClient(host=host, port=port, api_key=api_key)
+    return QdrantClient(host=host, port=port, api_key=api_key, prefer_grpc=prefer_grpc, grpc_port=grpc_port)
+
+
+CHUNK_STORE_PATH = "data/qdrant_chunks.sqlite"
+
+# Campos que viajan en el payload de Qdrant; el resto del chunk queda en el ChunkStore local
+SLIM_PAYLOAD_FIELDS = ["chunk_id", "page", "source"]
+
+
+class ChunkStore:
+    """Campos pesados de cada chunk (contenido, título, url, vigencia) en SQLite local, por chunk_id.
+
+    Así Qdrant solo guarda y devuelve un payload mínimo; el texto se une tras la búsqueda.
+    """
+
+    def __init__(self, path: str = CHUNK_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # La subida escribe desde un hilo aparte (qdrant_upsert)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "chunk_id TEXT PRIMARY KEY, doc_id TEXT, title TEXT, content TEXT, url TEXT, vigencia TEXT)"
+            )
+            self._conn.commit()
+
+    def put_many(self, chunks: Sequence[DocumentChunk]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, doc_id, title, content, url, vigencia) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(c.chunk_id, c.doc_id, c.title, c.content, c.url, c.vigencia) for c in chunks],
+            )
+            self._conn.commit()
+
+    def get_many(self, chunk_ids: Sequence[str]) -> Dict[str, dict]:
+        """Campos por chunk_id en una sola consulta (los ids sin registro no aparecen)."""
+        if not chunk_ids:
+            return {}
+        placeholders = ",".join("?" * len(chunk_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_id, doc_id, title, content, url, vigencia FROM chunks "
+                f"WHERE chunk_id IN ({placeholders})",
+                list(chunk_ids),
+            ).fetchall()
+        return {
+            row[0]: {"doc_id": row[1], "title": row[2], "content": row[3], "url": row[4], "vigencia": row[5]}
+            for row in rows
+        }
 
 
 def ensure_collection(client: QdrantClient, collection: str, vector_size: int) -> None:
@@ -31,49 +87,94 @@ def ensure_collection(client: QdrantClient, collection: str, vector_size: int) -
         )
 
 
+UPSERT_BATCH_SIZE = 512
+
+
+def _slim_payload(chunk: DocumentChunk) -> dict:
+    return {"chunk_id": chunk.chunk_id, "page": chunk.page, "source": chunk.source}
+
+
+def _chunk_payload(chunk: DocumentChunk) -> dict:
+    return {
+        "doc_id": chunk.doc_id,
+        "title": chunk.title,
+        "content": chunk.content,
+        "page": chunk.page,
+        "chunk_id": chunk.chunk_id,
+        "source": chunk.source,
+        "url": chunk.url,
+        "vigencia": chunk.vigencia,
+    }
+
+
 def upsert_chunks(
     client: QdrantClient,
     collection: str,
     chunks: List[DocumentChunk],
     embeddings: np.ndarray,
+    batch_size: int = UPSERT_BATCH_SIZE,
+    start_id: int = 0,
+    store: Optional[ChunkStore] = None,
+    parallel: int = 1,
+    wait: bool = True,
 ) -> None:
-    # Qdrant Point ID debe ser int/uuid; usamos ints y guardamos chunk_id real en payload
-    points = []
-    for idx, (chunk, vec) in enumerate(zip(chunks, embeddings)):
-        payload = {
-            "doc_id": chunk.doc_id,
-            "title": chunk.title,
-            "content": chunk.content,
-            "page": chunk.page,
-            "chunk_id": chunk.chunk_id,
-            "source": chunk.source,
-            "url": chunk.url,
-            "vigencia": chunk.vigencia,
-        }
-        points.append(PointStruct(id=idx, vector=vec.tolist(), payload=payload))
+    """Sube los chunks en lotes de `batch_size` puntos.
 
-    client.upsert(collection_name=collection, points=points)
+    Los vectores se pasan como matriz numpy (sin convertir a listas de floats de Python) y los
+    payloads se generan a medida que se envía cada lote, así la memoria no crece con el corpus.
+    Los ids son start_id, start_id + 1, ... (para subir un corpus por partes).
+    Con `store`, los campos pesados se guardan ahí y Qdrant recibe solo chunk_id, page y source.
+    `parallel` > 1 abre un pool de procesos en cada llamada: conviene solo al subir el corpus
+    completo de una vez, no al llamarla por tandas como rag.qdrant_upsert.
+    Con wait=False Qdrant confirma sin esperar a aplicar los puntos; quien sube por tandas debe
+    dejar wait=True en la última para sincronizar.
+    """
+    if store is not None:
+        store.put_many(chunks)
+    make_payload = _slim_payload if store is not None else _chunk_payload
+    # Qdrant Point ID debe ser int/uuid; usamos ints y guardamos chunk_id real en payload
+    client.upload_collection(
+        collection_name=collection,
+        vectors=np.ascontiguousarray(embeddings, dtype=np.float32),
+        payload=(make_payload(chunk) for chunk in chunks),
+        ids=range(start_id, start_id + len(chunks)),
+        batch_size=batch_size,
+        parallel=parallel,
+        wait=wait,
+    )
 
 
 class QdrantRetriever:
     """Retriever simple contra Qdrant."""
 
-    def __init__(self, collection: Optional[str] = None, model_name: str = None):
+    def __init__(self, collection: Optional[str] = None, model_name: str = None,
+                 store_path: Optional[str] = None):
         self.collection = collection or os.getenv("QDRANT_COLLECTION", "ufro_chunks")
         self.client = get_qdrant_client()
         self.embedding_system = EmbeddingSystem(model_name=model_name or os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2"))
+        # Con el ChunkStore de rag.qdrant_upsert (QDRANT_SLIM_PAYLOAD=1) se pide a Qdrant solo el payload mínimo
+        store_path = store_path or os.getenv("QDRANT_CHUNK_STORE", CHUNK_STORE_PATH)
+        self.store = ChunkStore(store_path) if os.path.exists(store_path) else None
+        self._store_path = store_path
+        self._warned_no_content = False
 
     def search(self, query: str, k: int = 4) -> List[DocumentChunk]:
-        qvec = self.embedding_system.embed_text(query)[0]
+        # La fila numpy se pasa tal cual (qdrant-client acepta ndarray; con gRPC viaja como buffer)
+        qvec = np.ascontiguousarray(self.embedding_system.embed_text(query)[0], dtype=np.float32)
         res = self.client.search(
             collection_name=self.collection,
-            query_vector=qvec.tolist(),
+            query_vector=qvec,
             limit=k,
-            with_payload=True,
+            with_payload=SLIM_PAYLOAD_FIELDS if self.store is not None else True,
         )
+        stored = {}
+        if self.store is not None:
+            stored = self.store.get_many([str((p.payload or {}).get("chunk_id", "")) for p in res])
         results: List[DocumentChunk] = []
         for p in res:
             pl = p.payload or {}
+            # Campos del ChunkStore si están; si no, los del payload (colecciones con payload completo)
+            pl = {**pl, **stored.get(str(pl.get("chunk_id", "")), {})}
             chunk = DocumentChunk(
                 content=pl.get("content", ""),
                 source=str(pl.get("source", pl.get("doc_id", ""))),
@@ -87,4 +188,10 @@ class QdrantRetriever:
             # Anotar score (mayor = más similar con cosine)
             setattr(chunk, "score", float(p.score))
             results.append(chunk)
+        if not self._warned_no_content and any(not c.content for c in results):
+            # Colección subida con QDRANT_SLIM_PAYLOAD=1 sin su ChunkStore: el contexto llegaría vacío al LLM
+            self._warned_no_content = True
+            print(f"[qdrant] ADVERTENCIA: resultados sin contenido en '{self.collection}'. "
+                  f"Si se subió con QDRANT_SLIM_PAYLOAD=1, falta o está incompleto el ChunkStore "
+                  f"'{self._store_path}' (QDRANT_CHUNK_STORE); copia ese archivo o vuelve a subir la colección.")
         return results
@@ -1,63 +1,284 @@
 from __future__ import annotations
 
+import json
 import os
+import queue
+import threading
 import time
-from typing import Any, Dict, List
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List
 
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, jsonify
-import faiss
-import pandas as pd
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 
 from providers.chatgpt import ChatGPTProvider
 from providers.deepseek import DeepSeekProvider
 from providers.mock import MockProvider
-from rag.retrieve import retrieve
+from providers.tokens import count_tokens, count_message_tokens
+from rag.retrieve import Retriever, load_chunks_df, load_faiss_index, normalize_query, preferred_index_path
 from rag.prompts import build_user_prompt, get_system_prompt
 
 
 load_dotenv()
 app = Flask(__name__)
 
+# Opciones del selector de proveedor (iguales para / y /ask)
+PROVIDERS = (
+    {"key": "chatgpt", "label": "ChatGPT"},
+    {"key": "deepseek", "label": "DeepSeek"},
+    {"key": "mock", "label": "Mock (sin costo)"},
+    {"key": "compare", "label": "Comparar (ChatGPT vs DeepSeek)"},
+)
+
+
+def _configure_templates(debug: bool) -> None:
+    """Fuera de debug la plantilla se compila una vez y no se revisa su fecha en cada render."""
+    app.config["TEMPLATES_AUTO_RELOAD"] = debug
+    app.jinja_env.auto_reload = debug
+    app.jinja_env.get_template("index.html")
+
+
 # Cache ligero en memoria para acelerar primeras consultas
 INDEX_PATH = os.getenv("FAISS_INDEX", "data/index.faiss")
 CHUNKS_PATH = os.getenv("CHUNKS_PARQUET", "data/processed/chunks_with_embeddings.parquet")
 _INDEX = None
 _CHUNKS_DF = None
+# None: según RERANK_ENABLE; --no-rerank lo fuerza a False
+_RERANK: bool | None = None
+# Retriever construido una sola vez sobre _INDEX/_CHUNKS_DF (la lista de chunks no se rearma por solicitud)
+_RETRIEVER: Retriever | None = None
+_RAG_LOCK = threading.Lock()
 
 
 def _load_rag_cache():
-    global _INDEX, _CHUNKS_DF
-    if _INDEX is None and os.path.exists(INDEX_PATH):
-        _INDEX = faiss.read_index(INDEX_PATH)
+    if _RETRIEVER is None:
+        with _RAG_LOCK:
+            _load_rag_cache_locked()
+
+
+def _load_rag_cache_locked():
+    global _INDEX, _CHUNKS_DF, _RETRIEVER
+    if _RETRIEVER is not None:
+        return
+    index_path = preferred_index_path(INDEX_PATH)
+    if _INDEX is None and os.path.exists(index_path):
+        # Se prefiere el índice SQ8 (int8) si se generó con python -m rag.quantize_index;
+        # en índices IVF las listas invertidas se abren con mmap y se comparten vía page cache
+        _INDEX = load_faiss_index(index_path)
     if _CHUNKS_DF is None:
+        # Solo las columnas que usa el Retriever (sin la columna de embeddings), con memory_map
         if os.path.exists(CHUNKS_PATH):
-            _CHUNKS_DF = pd.read_parquet(CHUNKS_PATH)
+            _CHUNKS_DF = load_chunks_df(CHUNKS_PATH)
         else:
             # Fallback al archivo sin embeddings
             fallback = "data/processed/chunks.parquet"
             if os.path.exists(fallback):
-                _CHUNKS_DF = pd.read_parquet(fallback)
+                _CHUNKS_DF = load_chunks_df(fallback)
+    if _INDEX is not None and _CHUNKS_DF is not None:
+        _RETRIEVER = Retriever.from_prebuilt(_INDEX, _CHUNKS_DF, rerank_enabled=_RERANK)
+
+
+def _readahead(path: str) -> None:
+    """Pide al kernel leer el archivo por adelantado (posix_fadvise WILLNEED); no-op fuera de Linux/Unix."""
+    if not hasattr(os, "posix_fadvise") or not os.path.exists(path):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+
+
+def _warmup_enabled() -> bool:
+    return os.getenv("WEB_WARMUP", "0") == "1"
+
+
+def _warm_rag_cache() -> None:
+    """Carga índice, chunks y modelos al arrancar para que la primera consulta no pague la carga."""
+    t0 = time.perf_counter()
+    try:
+        for path in (preferred_index_path(INDEX_PATH), CHUNKS_PATH):
+            _readahead(path)
+        _load_rag_cache()
+        if _RETRIEVER is not None:
+            # Una búsqueda descartable carga el modelo de embeddings (y el de rerank si está activo)
+            _RETRIEVER.search("warmup", k=1)
+    except Exception as e:
+        print(f"[web] Precalentamiento incompleto: {e}")
+        return
+    print(f"[web] RAG precalentado en {time.perf_counter() - t0:.2f}s")
+
+
+def _get_retriever() -> Retriever:
+    if _RETRIEVER is None:
+        raise FileNotFoundError("No se encontraron el índice FAISS o los chunks procesados.")
+    return _RETRIEVER
+
+
+class _RetrievalBatcher:
+    """Agrupa las consultas que llegan dentro de una ventana corta y las resuelve con una sola búsqueda.
+
+    La primera solicitud de la ventana espera `window` segundos, toma todas las pendientes y
+    llama a Retriever.search_batch (un encode y un index.search para todas); las demás esperan su resultado.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = []
+
+    def retrieve(self, query: str, k: int) -> List[Dict[str, Any]]:
+        done = threading.Event()
+        slot: Dict[str, Any] = {}
+        with self._lock:
+            self._pending.append((query, k, done, slot))
+            leader = len(self._pending) == 1
+        if leader:
+            time.sleep(self.window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+            self._flush(batch)
+        else:
+            done.wait()
+        if "error" in slot:
+            raise slot["error"]
+        return slot["docs"]
+
+    @staticmethod
+    def _flush(batch: List[tuple]) -> None:
+        # Se busca con el mayor k del lote y cada solicitud toma sus primeros k
+        try:
+            results = _get_retriever().search_batch([q for q, _, _, _ in batch],
+                                                    k=max(k for _, k, _, _ in batch), as_dict=True)
+            for (_, k, _, slot), docs in zip(batch, results):
+                slot["docs"] = docs[:k]
+        except Exception as e:
+            for _, _, _, slot in batch:
+                slot["error"] = e
+        finally:
+            for _, _, done, _ in batch:
+                done.set()
+
+
+# Ventana de micro-batching de recuperación en ms (opcional; 0 = una búsqueda por solicitud)
+_BATCH_WINDOW_MS = float(os.getenv("RETRIEVAL_BATCH_MS", "0"))
+_BATCHER = _RetrievalBatcher(_BATCH_WINDOW_MS / 1000.0) if _BATCH_WINDOW_MS > 0 else None
+
+
+def _retrieve_docs(query: str, k: int) -> List[Dict[str, Any]]:
+    if _BATCHER is not None:
+        return _BATCHER.retrieve(query, k)
+    return _get_retriever().search(query, k, as_dict=True)
+
+
+# Una instancia por proveedor para todo el proceso: conserva sesiones HTTP, clientes async
+# y límites de tasa entre solicitudes (como _PROVIDER_CACHE en app.py)
+_PROVIDER_CACHE: Dict[str, Any] = {}
+_PROVIDER_LOCK = threading.Lock()
+_PROVIDER_CLASSES = {"chatgpt": ChatGPTProvider, "deepseek": DeepSeekProvider, "mock": MockProvider}
 
 
 def _instantiate_provider(provider_key: str):
     key = (provider_key or "").strip().lower()
+    if key not in _PROVIDER_CLASSES:
+        key = "mock"
+    prov = _PROVIDER_CACHE.get(key)
+    if prov is not None:
+        return prov
     try:
-        if key == "chatgpt":
-            return ChatGPTProvider()
-        if key == "deepseek":
-            return DeepSeekProvider()
-        if key == "mock":
-            return MockProvider()
+        prov = _PROVIDER_CLASSES[key]()
     except Exception as e:
-        # Si falla el proveedor (p.ej. falta de API key), degradar a Mock
+        # Si falla el proveedor (p.ej. falta de API key), degradar a Mock sin cachear el fallback,
+        # para volver a intentarlo en la próxima solicitud
         print(f"[web] No se pudo inicializar '{provider_key}': {e}")
         return MockProvider()
-    return MockProvider()
+    # Si dos solicitudes lo crearon a la vez, gana la primera
+    with _PROVIDER_LOCK:
+        return _PROVIDER_CACHE.setdefault(key, prov)
+
+
+def _compare_call(key: str, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    prov = _instantiate_provider(key)
+    t0 = time.perf_counter()
+    try:
+        ans = prov.chat(messages)
+    except Exception as e:
+        ans = f"[Error proveedor] {e}"
+    latency = time.perf_counter() - t0
+    return {
+        "label": key.upper(),
+        "model": getattr(prov, "model", prov.name),
+        "time_sec": latency,
+        "answer": ans,
+    }
+
+
+def _sse(event: Dict[str, Any]) -> str:
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+def _wants_stream() -> bool:
+    """?stream=1 o un cliente que pide text/event-stream (EventSource)."""
+    return request.args.get("stream") == "1" or request.accept_mimetypes.best == "text/event-stream"
 
 
-def _approx_tokens(text: str) -> int:
-    return max(1, len(text) // 4)
+def _stream_single(provider_key: str, messages: List[Dict[str, str]]):
+    """Eventos SSE con los fragmentos de un proveedor y, al final, tiempos, tokens y costo."""
+    prov = _instantiate_provider(provider_key)
+    t0 = time.perf_counter()
+    first_token_sec = None
+    parts: List[str] = []
+    try:
+        for delta in prov.stream_chat(messages):
+            if first_token_sec is None:
+                first_token_sec = time.perf_counter() - t0
+            parts.append(delta)
+            yield _sse({"type": "delta", "delta": delta})
+    except Exception as e:
+        yield _sse({"type": "error", "error": f"[Error proveedor] {e}"})
+    chat_sec = time.perf_counter() - t0
+    tokens_in = count_message_tokens(messages)
+    tokens_out = count_tokens("".join(parts))
+    try:
+        cost_est = prov.estimate_cost(tokens_in, tokens_out)
+    except Exception:
+        cost_est = 0.0
+    yield _sse({
+        "type": "done",
+        "model": getattr(prov, "model", prov.name),
+        "first_token_sec": first_token_sec,
+        "chat_sec": chat_sec,
+        "tokens_in": tokens_in,
+        "tokens_out": tokens_out,
+        "cost_est": cost_est,
+    })
+
+
+def _stream_compare(messages: List[Dict[str, str]]):
+    """Intercala los fragmentos de DeepSeek y ChatGPT a medida que llegan (un hilo por proveedor)."""
+    events: queue.Queue = queue.Queue()
+
+    def pump(key: str) -> None:
+        prov = _instantiate_provider(key)
+        t0 = time.perf_counter()
+        try:
+            for delta in prov.stream_chat(messages):
+                events.put({"type": "delta", "provider": key, "delta": delta})
+        except Exception as e:
+            events.put({"type": "error", "provider": key, "error": f"[Error proveedor] {e}"})
+        events.put({"type": "done", "provider": key, "model": getattr(prov, "model", prov.name),
+                    "time_sec": time.perf_counter() - t0})
+
+    keys = ("deepseek", "chatgpt")
+    for key in keys:
+        threading.Thread(target=pump, args=(key,), daemon=True).start()
+    remaining = len(keys)
+    while remaining:
+        event = events.get()
+        if event["type"] == "done":
+            remaining -= 1
+        yield _sse(event)
 
 
 def _format_docs(docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -104,67 +325,36 @@ def healthz():
 
 @app.get("/")
 def index():
-    providers = [
-        {"key": "chatgpt", "label": "ChatGPT"},
-        {"key": "deepseek", "label": "DeepSeek"},
-        {"key": "mock", "label": "Mock (sin costo)"},
-        {"key": "compare", "label": "Comparar (ChatGPT vs DeepSeek)"},
-    ]
-    return render_template("index.html", providers=providers, provider_status=_provider_status(), result=None)
-
-
-@app.post("/ask")
-def ask():
-    _load_rag_cache()
-
-    query = (request.form.get("query") or (request.json.get("query") if request.is_json else None) or "").strip()
-    provider_key = (request.form.get("provider") or (request.json.get("provider") if request.is_json else None) or "mock").strip().lower()
-    k = int((request.form.get("k") or (request.json.get("k") if request.is_json else None) or 5))
+    return render_template("index.html", providers=PROVIDERS, provider_status=_provider_status(), result=None)
 
-    print(f"[web] Incoming ask: provider='{provider_key}', k={k}, len(query)={len(query)}")
 
-    # Recuperación de contexto
+def _prepare(query: str, k: int):
+    """Recupera el contexto y arma los mensajes una sola vez (los usan tanto el modo normal como el stream)."""
     try:
-        t_retr0 = time.time()
-        retrieved_chunks = retrieve(query, index=_INDEX, chunks_df=_CHUNKS_DF, k=k)
-        t_retr = time.time() - t_retr0
+        t_retr0 = time.perf_counter()
+        context_docs = _retrieve_docs(query, k)
+        t_retr = time.perf_counter() - t_retr0
     except FileNotFoundError:
-        retrieved_chunks = []
+        context_docs = []
         t_retr = 0.0
 
-    context_docs = []
-    for chunk in retrieved_chunks:
-        context_docs.append({
-            'content': getattr(chunk, 'content', ''),
-            'source': getattr(chunk, 'source', ''),
-            'page': getattr(chunk, 'page', None),
-            'score': getattr(chunk, 'score', None)
-        })
-
     user_prompt = build_user_prompt(query, context_docs)
     system_prompt = get_system_prompt()
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt},
     ]
+    return context_docs, t_retr, messages
+
+
+def _answer(query: str, provider_key: str, k: int) -> Dict[str, Any]:
+    context_docs, t_retr, messages = _prepare(query, k)
 
     result: Dict[str, Any]
     if provider_key == "compare":
-        comps = []
-        for key in ("deepseek", "chatgpt"):
-            prov = _instantiate_provider(key)
-            t0 = time.time()
-            try:
-                ans = prov.chat(messages)
-            except Exception as e:
-                ans = f"[Error proveedor] {e}"
-            latency = time.time() - t0
-            comps.append({
-                "label": key.upper(),
-                "model": getattr(prov, "model", prov.name),
-                "time_sec": latency,
-                "answer": ans,
-            })
+        # Las dos llamadas remotas son independientes: en paralelo, el total es la más lenta
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            comps = list(ex.map(lambda key: _compare_call(key, messages), ("deepseek", "chatgpt")))
         print("[web] Compare done: deepseek vs chatgpt")
         result = {
             "mode": "compare",
@@ -176,14 +366,14 @@ def ask():
         }
     else:
         prov = _instantiate_provider(provider_key)
-        t0 = time.time()
+        t0 = time.perf_counter()
         try:
             answer = prov.chat(messages)
         except Exception as e:
             answer = f"[Error proveedor] {e}"
-        chat_sec = time.time() - t0
-        tokens_in = _approx_tokens(str(messages))
-        tokens_out = _approx_tokens(answer)
+        chat_sec = time.perf_counter() - t0
+        tokens_in = count_message_tokens(messages)
+        tokens_out = count_tokens(answer)
         try:
             cost_est = prov.estimate_cost(tokens_in, tokens_out)
         except Exception:
@@ -203,20 +393,99 @@ def ask():
             "docs": _format_docs(context_docs),
             "provider_status": _provider_status(),
         }
+    return result
+
+
+# Single-flight: solicitudes idénticas simultáneas comparten una sola recuperación y llamada al LLM
+_IN_FLIGHT: Dict[tuple, Future] = {}
+_IN_FLIGHT_LOCK = threading.Lock()
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", "60"))
+
+
+def _single_flight(key: tuple, fn: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    """Ejecuta fn una vez por clave en curso; las solicitudes que llegan mientras tanto esperan su resultado.
+
+    Si la espera supera SINGLE_FLIGHT_TIMEOUT, la solicitud hace el trabajo por su cuenta.
+    """
+    with _IN_FLIGHT_LOCK:
+        future = _IN_FLIGHT.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _IN_FLIGHT[key] = future
+    if not leader:
+        try:
+            return future.result(timeout=SINGLE_FLIGHT_TIMEOUT)
+        except FutureTimeoutError:
+            return fn()
+    try:
+        result = fn()
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _IN_FLIGHT_LOCK:
+            _IN_FLIGHT.pop(key, None)
+
+
+@app.post("/ask")
+def ask():
+    _load_rag_cache()
+
+    query = (request.form.get("query") or (request.json.get("query") if request.is_json else None) or "").strip()
+    provider_key = (request.form.get("provider") or (request.json.get("provider") if request.is_json else None) or "mock").strip().lower()
+    k = int((request.form.get("k") or (request.json.get("k") if request.is_json else None) or 5))
+
+    print(f"[web] Incoming ask: provider='{provider_key}', k={k}, len(query)={len(query)}")
+
+    if _wants_stream():
+        context_docs, t_retr, messages = _prepare(query, k)
+
+        # Primero el contexto recuperado; luego los fragmentos de la respuesta según llegan
+        def events():
+            yield _sse({"type": "docs", "question": query, "retrieval_sec": t_retr,
+                        "docs": _format_docs(context_docs)})
+            if provider_key == "compare":
+                yield from _stream_compare(messages)
+            else:
+                yield from _stream_single(provider_key, messages)
+
+        return Response(stream_with_context(events()), mimetype="text/event-stream",
+                        headers={"X-Accel-Buffering": "no"})
+
+    # Misma consulta (misma regla que la caché del Retriever: normalize_query), proveedor y k
+    key = (normalize_query(query), provider_key, k)
+    result = _single_flight(key, lambda: _answer(query, provider_key, k))
 
     if request.is_json:
         return jsonify(result)
 
-    providers = [
-        {"key": "chatgpt", "label": "ChatGPT"},
-        {"key": "deepseek", "label": "DeepSeek"},
-        {"key": "mock", "label": "Mock (sin costo)"},
-        {"key": "compare", "label": "Comparar (ChatGPT vs DeepSeek)"},
-    ]
-    return render_template("index.html", providers=providers, provider_status=_provider_status(), result=result)
+    return render_template("index.html", providers=PROVIDERS, provider_status=_provider_status(), result=result)
 
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-rerank", action="store_true", help="Desactiva el rerank con cross-encoder")
+    args = parser.parse_args()
+    if args.no_rerank:
+        _RERANK = False
+
     # Puerto configurable por env var (útil en EC2)
     port = int(os.getenv("PORT", "8000"))
+    _configure_templates(debug=True)
+    # Con debug=True el reloader de Werkzeug relanza el script: solo el proceso hijo que sirve
+    # (WERKZEUG_RUN_MAIN=true) precalienta, en segundo plano mientras el servidor empieza a escuchar
+    if _warmup_enabled() and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        threading.Thread(target=_warm_rag_cache, daemon=True).start()
     app.run(host="0.0.0.0", port=port, debug=True)
+else:
+    # Importado por un servidor WSGI (gunicorn, etc.); con WEB_WARMUP=1 el worker queda listo
+    # antes de aceptar solicitudes. Por defecto no: importar web no debe cargar índice ni modelos
+    _configure_templates(debug=False)
+    if _warmup_enabled():
+        _warm_rag_cache()